@@ -2,7 +2,10 @@ from __future__ import absolute_import, division, print_function
 import argparse
 import contextlib
 import datetime
+import functools
 import hashlib
+import json
+import marshal
 import os
 import re
 import shutil
@@ -10,15 +13,49 @@ import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
 
-from time import time
-from multiprocessing import Pool, cpu_count
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep, time
+from multiprocessing import cpu_count
 
 try:
     import lzma
 except ImportError:
     lzma = None
 
+try:
+    # Python 3.14 and later
+    from compression.zstd import ZstdFile
+except ImportError:
+    ZstdFile = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+try:
+    import http.client as http_client
+    from urllib.parse import urljoin, urlsplit
+except ImportError:
+    http_client = None
+
 
 def platform_is_win32():
     return sys.platform == "win32"
@@ -43,88 +80,276 @@ def get_cpus():
         return 1
 
 
+# Components are downloaded and unpacked from several threads; keep their
+# messages from interleaving within a line.
+print_lock = threading.Lock()
+
+
 def eprint(*args, **kwargs):
     kwargs["file"] = sys.stderr
-    print(*args, **kwargs)
+    with print_lock:
+        print(*args, **kwargs)
 
 
-def get(base, url, path, checksums, verbose=False):
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        temp_path = temp_file.name
+class StartupTrace(object):
+    """Timings of the phases of x.py, and counters such as bytes downloaded
 
-    try:
-        if url not in checksums:
-            raise RuntimeError(
-                (
-                    "src/stage0 doesn't contain a checksum for {}. "
-                    "Pre-built artifacts might not be available for this "
-                    "target at this time, see https://doc.rust-lang.org/nightly"
-                    "/rustc/platform-support.html for more information."
-                ).format(url)
+    If the `BOOTSTRAP_STARTUP_TRACE` environment variable is set, `main` writes
+    them to the file it names in the Chrome trace event format, which can be
+    loaded in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    ENV_VAR = "BOOTSTRAP_STARTUP_TRACE"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = monotonic()
+        self.events = []
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def phase(self, name, **args):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            end = monotonic()
+            with self.lock:
+                self.events.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": int((start - self.start) * 1e6),
+                        "dur": int((end - start) * 1e6),
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": args,
+                    }
+                )
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def write(self, path):
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        events.append(
+            {
+                "name": "counters",
+                "ph": "C",
+                "ts": int((monotonic() - self.start) * 1e6),
+                "pid": os.getpid(),
+                "args": counters,
+            }
+        )
+        with output(path) as f:
+            json.dump({"traceEvents": events, "otherData": counters}, f, sort_keys=True)
+
+
+trace = StartupTrace()
+
+
+def get(
+    base, url, path, checksums, verbose=False, progress_bar=True, verify_download=True
+):
+    """Download `url` from `base` to `path`
+
+    The download goes to `path` + ".part" first, which is left behind if it
+    fails, so that the next attempt resumes it instead of starting over. Only
+    one process at a time gets to use it, others download to a private file
+    instead, see `try_lock`.
+
+    Unless `verify_download` is false the checksum of the download is checked
+    before it's moved to `path`. Callers passing `False` are responsible for
+    verifying it themselves, e.g. by passing the checksum to `unpack`. Resumed
+    downloads are always checked, so that a bad partial download is discarded
+    and fetched again from scratch instead of failing later.
+    """
+    if url not in checksums:
+        raise RuntimeError(
+            (
+                "src/stage0 doesn't contain a checksum for {}. "
+                "Pre-built artifacts might not be available for this "
+                "target at this time, see https://doc.rust-lang.org/nightly"
+                "/rustc/platform-support.html for more information."
+            ).format(url)
+        )
+    sha256 = checksums[url]
+    if os.path.exists(path):
+        if verify(path, sha256, False):
+            if verbose:
+                eprint("using already-download file", path)
+            return
+        else:
+            if verbose:
+                eprint(
+                    "ignoring already-download file",
+                    path,
+                    "due to failed verification",
+                )
+            os.unlink(path)
+
+    part_path = path + ".part"
+    with try_lock(part_path + ".lock") as locked:
+        if locked:
+            resumed = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        else:
+            # Another process is downloading the same file, don't get in its
+            # way.
+            fd, part_path = tempfile.mkstemp(
+                dir=os.path.dirname(path) or ".",
+                prefix=os.path.basename(path) + ".",
+                suffix=".part",
             )
-        sha256 = checksums[url]
-        if os.path.exists(path):
-            if verify(path, sha256, False):
-                if verbose:
-                    eprint("using already-download file", path)
-                return
-            else:
-                if verbose:
-                    eprint(
-                        "ignoring already-download file",
-                        path,
-                        "due to failed verification",
-                    )
-                os.unlink(path)
-        download(temp_path, "{}/{}".format(base, url), True, verbose)
-        if not verify(temp_path, sha256, verbose):
-            raise RuntimeError("failed verification")
-        if verbose:
-            eprint("moving {} to {}".format(temp_path, path))
-        shutil.move(temp_path, path)
-    finally:
-        if os.path.isfile(temp_path):
+            os.close(fd)
+            resumed = 0
+        if resumed and verbose:
+            eprint("resuming {} after {} bytes".format(part_path, resumed))
+        try:
+            with trace.phase("download", url=url):
+                download(
+                    part_path, "{}/{}".format(base, url), True, verbose, progress_bar
+                )
+        except BaseException:
+            # Nobody could resume a private download.
+            if not locked:
+                os.unlink(part_path)
+            raise
+        trace.count("bytes downloaded", os.path.getsize(part_path) - resumed)
+        verify_download = verify_download or resumed > 0
+        if verify_download:
+            with trace.phase("verify", path=path):
+                verified = verify(part_path, sha256, verbose, use_cache=False)
+            if not verified:
+                os.unlink(part_path)
+                if not resumed:
+                    raise RuntimeError("failed verification")
+        else:
+            verified = True
+        if verified:
             if verbose:
-                eprint("removing", temp_path)
-            os.unlink(temp_path)
+                eprint("moving {} to {}".format(part_path, path))
+            os.replace(part_path, path)
+            if locked:
+                # Nothing is left to resume, don't leave the lock file behind.
+                # `try_lock` notices if a process waited for it meanwhile.
+                try:
+                    os.unlink(part_path + ".lock")
+                except OSError:
+                    # Windows doesn't remove files that are still open.
+                    pass
+    if not verified:
+        # The partial download may have been damaged, or belong to an older
+        # tarball with the same name. Start over once.
+        eprint("discarding partial download of {}".format(url))
+        return get(base, url, path, checksums, verbose, progress_bar)
+    if verify_download:
+        record_verified(path, sha256)
+
 
+@contextlib.contextmanager
+def try_lock(path):
+    """Try to take an exclusive lock on the file at `path`, without waiting
 
-def curl_version():
-    m = re.match(bytes("^curl ([0-9]+)\\.([0-9]+)", "utf8"), require(["curl", "-V"]))
+    Yields whether the lock was taken. It's released on exit, or by the
+    operating system if the process dies first. The lock file may be removed
+    while the lock is held, in which case whoever locked it in the meantime
+    doesn't get the lock.
+    """
+    with open(path, "a+b") as f:
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            locked = os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+        except OSError:
+            locked = False
+        yield locked
+
+
+@functools.lru_cache(maxsize=None)
+def curl_version(exception=False):
+    """Return the (major, minor) version of curl
+
+    This is called for every download, so the result is cached.
+    """
+    m = re.match(
+        bytes("^curl ([0-9]+)\\.([0-9]+)", "utf8"),
+        require(["curl", "-V"], exception=exception),
+    )
     if m is None:
         return (0, 0)
     return (int(m[1]), int(m[2]))
 
 
-def download(path, url, probably_big, verbose):
+def download(path, url, probably_big, verbose, progress_bar=True):
+    """Download `url` to `path`, retrying with exponential backoff
+
+    Whatever a failed attempt left in `path` is resumed by the next one.
+    """
+    delay = 1
     for _ in range(4):
         try:
-            _download(path, url, probably_big, verbose, True)
+            _download(path, url, probably_big, verbose, True, progress_bar)
             return
         except RuntimeError:
-            eprint("\nspurious failure, trying again")
-    _download(path, url, probably_big, verbose, False)
+            eprint("\nspurious failure, trying again in {}s".format(delay))
+            sleep(delay)
+            delay *= 2
+    _download(path, url, probably_big, verbose, False, progress_bar)
 
 
-def _download(path, url, probably_big, verbose, exception):
-    # Try to use curl (potentially available on win32
-    #    https://devblogs.microsoft.com/commandline/tar-and-curl-come-to-windows/)
+def _download(path, url, probably_big, verbose, exception, progress_bar=True):
+    # Try to download in-process first, then to use curl (potentially available
+    # on win32 https://devblogs.microsoft.com/commandline/tar-and-curl-come-to-windows/)
     # If an error occurs:
     #  - If we are on win32 fallback to powershell
     #  - Otherwise raise the error if appropriate
     if probably_big or verbose:
         eprint("downloading {}".format(url))
 
+    show_progress = (
+        (probably_big or verbose)
+        and progress_bar
+        and "GITHUB_ACTIONS" not in os.environ
+    )
+    if url.startswith("file://"):
+        # A local mirror, e.g. one made by `x.py prefetch-stage0`.
+        from urllib.request import url2pathname
+
+        try:
+            shutil.copyfile(url2pathname(urlsplit(url).path), path)
+        except OSError as e:
+            err = "failed to copy {}: {}".format(url, e)
+            if exception:
+                raise RuntimeError(err) from e
+            eprint("ERROR: " + err)
+            sys.exit(1)
+        return
+    if http_downloader.supports(url):
+        try:
+            http_downloader.download(path, url, show_progress)
+            return
+        except (RuntimeError, ValueError, OSError, http_client.HTTPException) as e:
+            # Whatever went wrong is likely to happen again, leave the
+            # remaining downloads to curl, which resumes this one.
+            http_downloader.failed = True
+            if verbose:
+                eprint("in-process download failed ({}), using curl".format(e))
+
     try:
-        if (probably_big or verbose) and "GITHUB_ACTIONS" not in os.environ:
+        if show_progress:
             option = "--progress-bar"
         else:
             option = "--silent"
         # If curl is not present on Win32, we should not sys.exit
         #   but raise `CalledProcessError` or `OSError` instead
-        require(["curl", "--version"], exception=platform_is_win32())
         extra_flags = []
-        if curl_version() > (7, 70):
+        if curl_version(exception=platform_is_win32()) > (7, 70):
             extra_flags = ["--retry-all-errors"]
         # options should be kept in sync with
         # src/bootstrap/src/core/download.rs
@@ -177,12 +402,267 @@ def _download(path, url, probably_big, verbose, exception):
             raise
 
 
-def verify(path, expected, verbose):
-    """Check if the sha256 sum of the given path is valid"""
+class HttpDownloader(object):
+    """Download files over HTTP(S) without spawning curl
+
+    Connections are kept open across downloads, one per thread and server,
+    so fetching all the components costs a single TLS handshake per thread.
+    If the server supports ranges, a file that already exists is resumed,
+    and the part of a big file past the first `SEGMENT_SIZE` bytes is
+    fetched as several ranges in parallel.
+    """
+
+    SEGMENT_SIZE = 16 * 1024 * 1024
+    MAX_SEGMENTS = 4
+    TIMEOUT = 30
+
+    def __init__(self):
+        self.local = threading.local()
+        self.failed = False
+
+    def supports(self, url):
+        """Whether `url` can be downloaded in-process"""
+        if self.failed or http_client is None:
+            return False
+        scheme = urlsplit(url).scheme
+        if scheme not in ("http", "https") or (scheme == "https" and ssl is None):
+            return False
+        # curl honors these, but http.client doesn't.
+        return not any(
+            os.environ.get(var)
+            for proxy in ("http_proxy", "https_proxy", "all_proxy")
+            for var in (proxy, proxy.upper())
+        )
+
+    def connection(self, scheme, netloc):
+        connections = self.local.__dict__.setdefault("connections", {})
+        if (scheme, netloc) not in connections:
+            if scheme == "https":
+                connection = http_client.HTTPSConnection(
+                    netloc,
+                    timeout=self.TIMEOUT,
+                    context=ssl.create_default_context(),
+                )
+            else:
+                connection = http_client.HTTPConnection(netloc, timeout=self.TIMEOUT)
+            connections[(scheme, netloc)] = connection
+        return connections[(scheme, netloc)]
+
+    def request(self, url, headers):
+        """Send a GET request, following redirects
+
+        Return the final URL and the response.
+        """
+        for _ in range(10):
+            parts = urlsplit(url)
+            target = parts.path or "/"
+            if parts.query:
+                target += "?" + parts.query
+            connection = self.connection(parts.scheme, parts.netloc)
+            try:
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+            except (http_client.HTTPException, OSError):
+                # The server may have closed a connection we kept open;
+                # `request` reconnects after `close`.
+                connection.close()
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                url = urljoin(url, response.getheader("Location"))
+                continue
+            if response.status >= 400 and response.status != 416:
+                response.read()
+                raise RuntimeError("{} returned HTTP {}".format(url, response.status))
+            return url, response
+        raise RuntimeError("too many redirects for {}".format(url))
+
+    def download(self, path, url, show_progress=False):
+        """Download `url` to `path`, resuming it if it already exists"""
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        first_end = offset + self.SEGMENT_SIZE
+        url, response = self.request(
+            url, {"Range": "bytes={}-{}".format(offset, first_end - 1)}
+        )
+        if response.status == 416:
+            # Nothing left to download.
+            response.read()
+            return
+
+        if response.status == 206:
+            total = response.getheader("Content-Range", "").rpartition("/")[2]
+        else:
+            # The server ignored the range and sends the whole file.
+            offset = 0
+            total = response.getheader("Content-Length", "")
+        total = int(total) if total.isdigit() else None
+        progress = DownloadProgress(total, offset, show_progress)
+
+        with open(path, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            received = self.copy(response, f, progress)
+            expected = self.expected_length(response)
+            if expected is not None and received != expected:
+                # http.client doesn't complain if the connection is closed
+                # early. Keep what was received, so that it can be resumed.
+                f.truncate(offset + received)
+                raise RuntimeError("short read from {}".format(url))
+        if response.status != 206 or total is None or first_end >= total:
+            progress.finish()
+            return
+
+        # Fetch the rest of the file as parallel ranges, each written in
+        # place. If any of them fails, truncate the file after the last byte
+        # that is preceded by no holes so that it can be resumed.
+        count = min(self.MAX_SEGMENTS, -(-(total - first_end) // self.SEGMENT_SIZE))
+        bounds = [
+            first_end + (total - first_end) * i // count for i in range(count + 1)
+        ]
+        written = [0] * count
+
+        def fetch(i):
+            start, end = bounds[i], bounds[i + 1]
+            _, response = self.request(
+                url, {"Range": "bytes={}-{}".format(start, end - 1)}
+            )
+            if response.status != 206:
+                response.read()
+                raise RuntimeError("{} ignored a range request".format(url))
+            with open(path, "r+b") as f:
+                f.seek(start)
+                written[i] = self.copy(response, f, progress)
+            if written[i] != end - start:
+                raise RuntimeError("short read from {}".format(url))
+
+        try:
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                for future in [executor.submit(fetch, i) for i in range(count)]:
+                    future.result()
+        except BaseException:
+            complete = first_end
+            for i in range(count):
+                complete += written[i]
+                if complete != bounds[i + 1]:
+                    break
+            with open(path, "r+b") as f:
+                f.truncate(complete)
+            raise
+        progress.finish()
+
+    @staticmethod
+    def expected_length(response):
+        """Return the length of the body of `response`, if the server told it"""
+        if response.status == 206:
+            m = re.match(
+                r"bytes ([0-9]+)-([0-9]+)/", response.getheader("Content-Range", "")
+            )
+            if m is not None:
+                return int(m.group(2)) - int(m.group(1)) + 1
+        length = response.getheader("Content-Length", "")
+        return int(length) if length.isdigit() else None
+
+    @staticmethod
+    def copy(response, f, progress):
+        written = 0
+        while True:
+            chunk = response.read(64 * 1024)
+            if not chunk:
+                return written
+            f.write(chunk)
+            written += len(chunk)
+            progress.update(len(chunk))
+
+
+class DownloadProgress(object):
+    """A minimal progress indicator for `HttpDownloader`"""
+
+    def __init__(self, total, received, enabled):
+        self.total = total
+        self.received = received
+        self.enabled = enabled and bool(total) and sys.stderr.isatty()
+        self.lock = threading.Lock()
+        self.shown = None
+
+    def update(self, size):
+        with self.lock:
+            self.received += size
+            if not self.enabled:
+                return
+            percent = 100 * self.received // self.total
+            if percent != self.shown:
+                self.shown = percent
+                bar = "#" * (percent * 60 // 100)
+                sys.stderr.write("\r{:<60} {:>3}%".format(bar, percent))
+                sys.stderr.flush()
+
+    def finish(self):
+        if self.enabled:
+            sys.stderr.write("\n")
+
+
+http_downloader = HttpDownloader()
+
+
+def verify(path, expected, verbose, use_cache=True):
+    """Check if the sha256 sum of the given path is valid
+
+    The file is hashed in chunks, so this does not need to hold it in memory.
+    Unless `use_cache` is false, a successful verification is recorded next to
+    the file, and later calls return early while the file is left untouched.
+    """
+    if use_cache and is_verified(path, expected):
+        if verbose:
+            eprint("already verified", path)
+        return True
     if verbose:
         eprint("verifying", path)
+    verified = check_checksum(sha256_file(path), expected)
+    if verified and use_cache:
+        record_verified(path, expected)
+    return verified
+
+
+def sha256_file(path):
+    """Return the sha256 sum of the given path, hashed in chunks"""
+    sha256 = hashlib.sha256()
     with open(path, "rb") as source:
-        found = hashlib.sha256(source.read()).hexdigest()
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def verified_stamp(path):
+    """Return the path of the file recording that `path` has been verified"""
+    return path + ".sha256"
+
+
+def verified_key(path, expected):
+    """Identify `path` as it is now, as having the checksum `expected`
+
+    If the file is replaced or modified, at least one of its inode, size and
+    modification time changes.
+    """
+    stat = os.stat(path)
+    return "{} {} {} {}".format(expected, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def is_verified(path, expected):
+    """Whether `path` has been verified to have the checksum `expected`"""
+    try:
+        with open(verified_stamp(path)) as stamp:
+            return stamp.read() == verified_key(path, expected)
+    except (IOError, OSError):
+        return False
+
+
+def record_verified(path, expected):
+    with output(verified_stamp(path)) as stamp:
+        stamp.write(verified_key(path, expected))
+
+
+def check_checksum(found, expected):
+    """Compare two sha256 sums, reporting a mismatch"""
     verified = found == expected
     if not verified:
         eprint(
@@ -193,28 +673,218 @@ def verify(path, expected, verbose):
     return verified
 
 
-def unpack(tarball, tarball_suffix, dst, verbose=False, match=None):
-    """Unpack the given tarball file"""
+def tarball_suffix(stage0_data, download_path):
+    """Return the suffix of the tarball to fetch for `download_path`
+
+    zstd tarballs decompress several times faster than xz ones, so they are
+    used if src/stage0 has a checksum for them and zstd is available.
+
+    >>> tarball_suffix({}, "dist/2025-01-01/rustc-beta-host") in (".tar.xz", ".tar.gz")
+    True
+    """
+    if download_path + ".tar.zst" in stage0_data and zstd_available():
+        return ".tar.zst"
+    return ".tar.gz" if lzma is None else ".tar.xz"
+
+
+@functools.lru_cache(maxsize=None)
+def zstd_available():
+    """Whether zstd tarballs can be decompressed, in-process or with `zstd`"""
+    return (
+        ZstdFile is not None
+        or zstandard is not None
+        or shutil.which("zstd") is not None
+    )
+
+
+@contextlib.contextmanager
+def zstd_decompressed(fileobj):
+    """Yield a file object with the decompressed contents of `fileobj`"""
+    if ZstdFile is not None:
+        with ZstdFile(fileobj) as decompressed:
+            yield decompressed
+        return
+    if zstandard is not None:
+        # Tarballs may be compressed as several frames, e.g. by `zstd -T0`.
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            fileobj, read_across_frames=True
+        )
+        with reader as decompressed:
+            yield decompressed
+        return
+
+    process = subprocess.Popen(
+        ["zstd", "-d", "-c", "-q"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+
+    def feed():
+        try:
+            for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+                process.stdin.write(chunk)
+        except OSError:
+            # zstd exited early, its exit code tells why.
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        yield process.stdout
+        # tarfile stops reading at the end of the archive, let zstd finish.
+        while process.stdout.read(1024 * 1024):
+            pass
+    finally:
+        process.stdout.close()
+        feeder.join()
+        returncode = process.wait()
+    if returncode != 0:
+        raise RuntimeError("zstd failed with exit code {}".format(returncode))
+
+
+class HashingReader(object):
+    """Wrap a file object, computing the sha256 of everything read from it"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        """Return the sha256 of the whole file, reading what is left of it"""
+        while self.read(1024 * 1024):
+            pass
+        return self.sha256.hexdigest()
+
+
+def unpack(tarball, tarball_suffix, dst, verbose=False, match=None, checksum=None):
+    """Unpack the given tarball file
+
+    Only the members under `<tarball name>/<match>/` are extracted, and that
+    prefix is stripped while they are written to `dst`, in a single pass over
+    the archive.
+
+    If `checksum` is given, the sha256 of the tarball is computed while it's
+    being decompressed. If it doesn't match, the files extracted so far and the
+    tarball itself are removed, so that it gets downloaded again, and a
+    `RuntimeError` is raised. Tarballs that `verify` already checked are not
+    hashed again. Members that would be written outside of `dst` are refused
+    with a `RuntimeError` either way.
+
+    Returns the number of extracted members.
+    """
     eprint("extracting", tarball)
+    if checksum is not None and is_verified(tarball, checksum):
+        checksum = None
     fname = os.path.basename(tarball).replace(tarball_suffix, "")
-    with contextlib.closing(tarfile.open(tarball)) as tar:
-        for member in tar.getnames():
-            if "/" not in member:
-                continue
-            name = member.replace(fname + "/", "", 1)
-            if match is not None and not name.startswith(match):
-                continue
-            name = name[len(match) + 1 :]
 
-            dst_path = os.path.join(dst, name)
-            if verbose:
-                eprint("  extracting", member)
-            tar.extract(member, dst)
-            src_path = os.path.join(dst, member)
-            if os.path.isdir(src_path) and os.path.exists(dst_path):
-                continue
-            shutil.move(src_path, dst_path)
-    shutil.rmtree(os.path.join(dst, fname))
+    def extracted_name(member_name):
+        if "/" not in member_name:
+            return None
+        name = member_name.replace(fname + "/", "", 1)
+        if match is not None and not name.startswith(match):
+            return None
+        return name[len(match) + 1 :]
+
+    # Members are written before the checksum is known, so make sure that
+    # none of them can end up outside of `dst`, even through a symlink
+    # extracted earlier.
+    links = set()
+
+    def check_member(member):
+        def escapes(name):
+            parts = name.split("/")
+            return (
+                name.startswith("/")
+                or os.path.isabs(name)
+                or ".." in parts
+                or any("/".join(parts[:i]) in links for i in range(1, len(parts)))
+            )
+
+        if member.issym():
+            target = os.path.normpath(
+                os.path.join(os.path.dirname(member.name), member.linkname)
+            ).replace(os.sep, "/")
+            unsafe = os.path.isabs(member.linkname) or escapes(target)
+        elif member.islnk():
+            unsafe = not member.linkname or escapes(member.linkname)
+        else:
+            unsafe = False
+        if unsafe or escapes(member.name):
+            raise RuntimeError(
+                "refusing to extract {} from {}".format(member.name, tarball)
+            )
+        if member.issym():
+            links.add(member.name)
+
+    extracted = []
+    count = 0
+    error = None
+    # Let tarfile apply its own checks too, where it has them.
+    extract_filter = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    with open(tarball, "rb") as source:
+        reader = source if checksum is None else HashingReader(source)
+        try:
+            with contextlib.ExitStack() as stack:
+                fileobj, mode = reader, "r|*"
+                if tarball_suffix == ".tar.zst":
+                    # tarfile doesn't know about zstd, give it the decompressed data.
+                    fileobj = stack.enter_context(zstd_decompressed(reader))
+                    mode = "r|"
+                tar = tarfile.open(fileobj=fileobj, mode=mode)
+                with contextlib.closing(tar):
+                    for member in tar:
+                        name = extracted_name(member.name)
+                        if not name:
+                            continue
+
+                        if verbose:
+                            eprint("  extracting", member.name)
+                        member.name = name
+                        if member.islnk():
+                            member.linkname = extracted_name(member.linkname)
+                        check_member(member)
+                        # Remember the outermost file or directory this creates,
+                        # to be able to undo it if the checksum doesn't match.
+                        created = os.path.join(dst, name)
+                        while not os.path.lexists(os.path.dirname(created)):
+                            created = os.path.dirname(created)
+                        if not os.path.lexists(created):
+                            extracted.append(created)
+                        tar.extract(member, dst, **extract_filter)
+                        count += 1
+        except Exception as e:
+            # A corrupted download usually fails to decompress; if that's the
+            # case, report the checksum mismatch rather than the symptom.
+            if checksum is None:
+                raise
+            error = e
+        if checksum is not None:
+            found = reader.hexdigest()
+
+    if checksum is not None and not check_checksum(found, checksum):
+        for path in extracted:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.unlink(path)
+        eprint("removing", tarball, "due to failed verification")
+        os.unlink(tarball)
+        if os.path.exists(verified_stamp(tarball)):
+            os.unlink(verified_stamp(tarball))
+        raise RuntimeError("failed verification")
+    if error is not None:
+        raise error
+    if checksum is not None:
+        record_verified(tarball, checksum)
+    return count
 
 
 def run(args, verbose=False, exception=False, is_bootstrap=False, **kwargs):
@@ -267,6 +937,74 @@ def require(cmd, exit=True, exception=False):
         return None
 
 
+def file_identity(path):
+    """Return something that changes whenever the file at `path` is replaced
+    or modified, or None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def fingerprint_changes(recorded, fingerprint, binary, command):
+    """Explain how the inputs of a bootstrap build differ from the recorded ones
+
+    `recorded` is what `RustBuild.record_bootstrap_fingerprint` wrote for the
+    previous build, `binary` the identity of the bootstrap binary before this
+    build, and `command` what `RustBuild.build_bootstrap` returned for it.
+
+    >>> recorded = {
+    ...     "inputs": {"env": {"RUSTFLAGS": "-g"}, "sources": {"a.rs": [1]}},
+    ...     "binary": [1, 2, 3],
+    ...     "command": {"args": ["cargo", "build"], "env": {"RUSTFLAGS": "-g"}},
+    ... }
+    >>> fingerprint = {"env": {"RUSTFLAGS": "-O"}, "sources": {"a.rs": [1], "b.rs": [2]}}
+    >>> command = {"args": ["cargo", "build"], "env": {"RUSTFLAGS": "-O"}}
+    >>> for change in fingerprint_changes(recorded, fingerprint, None, command):
+    ...     print(change)
+    env RUSTFLAGS: -g -> -O
+    added b.rs
+    bootstrap binary is missing or was modified
+    cargo env RUSTFLAGS: -g -> -O
+    """
+    if recorded is None:
+        return ["no record of a previous build"]
+
+    changes = []
+
+    def compare(prefix, old, new):
+        if isinstance(old, dict) and isinstance(new, dict):
+            for key in sorted(set(old) | set(new)):
+                if key not in old:
+                    changes.append("added {}{}".format(prefix, key))
+                elif key not in new:
+                    changes.append("removed {}{}".format(prefix, key))
+                else:
+                    compare("{}{} ".format(prefix, key), old[key], new[key])
+        elif old != new:
+            changes.append("{}: {} -> {}".format(prefix.strip(), old, new))
+
+    inputs = recorded.get("inputs") or {}
+    for key in sorted(set(inputs) | set(fingerprint)):
+        # Source files are listed by their path alone.
+        compare(
+            "" if key == "sources" else key + " ", inputs.get(key), fingerprint.get(key)
+        )
+    if recorded.get("binary") != binary:
+        changes.append("bootstrap binary is missing or was modified")
+    old_command = recorded.get("command")
+    if old_command is not None and command is not None:
+        if old_command["args"] != command["args"]:
+            changes.append(
+                "cargo arguments: {} -> {}".format(
+                    " ".join(old_command["args"]), " ".join(command["args"])
+                )
+            )
+        compare("cargo env ", old_command["env"], command["env"])
+    return changes
+
+
 def format_build_time(duration):
     """Return a nicer format for build time
 
@@ -276,8 +1014,12 @@ def format_build_time(duration):
     return str(datetime.timedelta(seconds=int(duration)))
 
 
+@functools.lru_cache(maxsize=None)
 def default_build_triple(verbose):
-    """Build triple as in LLVM"""
+    """Build triple as in LLVM
+
+    The result is cached, since `configure.py` asks for it repeatedly.
+    """
     # If we're on Windows and have an existing `rustc` toolchain, use `rustc --version --verbose`
     # to find our host target triple. This fixes an issue with Windows builds being detected
     # as GNU instead of MSVC.
@@ -303,13 +1045,19 @@ def default_build_triple(verbose):
                 eprint("falling back to auto-detect")
 
     required = not platform_is_win32()
-    uname = require(["uname", "-smp"], exit=required)
+    if hasattr(os, "uname"):
+        # This is what `uname -sm` prints, without having to run it. `uname -p`
+        # is only needed in rare cases below, so it's run only then.
+        kernel, cputype = os.uname().sysname, os.uname().machine
+        processor = None
+    else:
+        uname = require(["uname", "-smp"], exit=required)
 
-    # If we do not have `uname`, assume Windows.
-    if uname is None:
-        return "x86_64-pc-windows-msvc"
+        # If we do not have `uname`, assume Windows.
+        if uname is None:
+            return "x86_64-pc-windows-msvc"
 
-    kernel, cputype, processor = uname.decode(default_encoding).split(maxsplit=2)
+        kernel, cputype, processor = uname.decode(default_encoding).split(maxsplit=2)
 
     # The goal here is to come up with the same triple as LLVM would,
     # at least for the subset of platforms we're willing to target.
@@ -327,10 +1075,9 @@ def default_build_triple(verbose):
     if kernel in kerneltype_mapper:
         kernel = kerneltype_mapper[kernel]
     elif kernel == "Linux":
-        # Apple doesn't support `-o` so this can't be used in the combined
-        # uname invocation above
-        ostype = require(["uname", "-o"], exit=required).decode(default_encoding)
-        if ostype == "Android":
+        # `uname -o` prints "Android" if `uname` was built for Android, which is
+        # the case exactly if Python was built for it as well.
+        if hasattr(sys, "getandroidapilevel"):
             kernel = "linux-android"
         else:
             kernel = "unknown-linux-gnu"
@@ -420,6 +1167,8 @@ def default_build_triple(verbose):
         if kernel == "linux-android":
             kernel = "linux-androideabi"
         elif kernel == "unknown-freebsd":
+            if processor is None:
+                processor = require(["uname", "-p"]).decode(default_encoding)
             cputype = processor
             kernel = "unknown-freebsd"
     elif cputype == "armv6l":
@@ -484,7 +1233,7 @@ class Stage0Toolchain:
 
 
 class DownloadInfo:
-    """A helper class that can be pickled into a parallel subprocess"""
+    """Where to fetch a stage0 component from, and where to install it"""
 
     def __init__(
         self,
@@ -496,6 +1245,7 @@ class DownloadInfo:
         stage0_data,
         pattern,
         verbose,
+        store_dir=None,
     ):
         self.base_download_url = base_download_url
         self.download_path = download_path
@@ -505,29 +1255,255 @@ class DownloadInfo:
         self.stage0_data = stage0_data
         self.pattern = pattern
         self.verbose = verbose
+        self.store_dir = store_dir
+
+    def store_entry(self):
+        """Return where the store keeps this component extracted, if anywhere
 
+        Entries of the store are named after the checksum of the tarball they
+        were extracted from, so they can be shared by any number of build
+        directories and checkouts using the same `bootstrap-cache-path`.
+        """
+        checksum = self.stage0_data.get(self.download_path)
+        if self.store_dir is None or checksum is None:
+            return None
+        return os.path.join(self.store_dir, checksum)
 
-def download_component(download_info):
-    if not os.path.exists(download_info.tarball_path):
+    def needs_download(self):
+        entry = self.store_entry()
+        if entry is not None and os.path.isdir(entry):
+            return False
+        return not os.path.exists(self.tarball_path)
+
+
+def download_component(download_info, progress_bar=True):
+    if download_info.needs_download():
         get(
             download_info.base_download_url,
             download_info.download_path,
             download_info.tarball_path,
             download_info.stage0_data,
             verbose=download_info.verbose,
+            progress_bar=progress_bar,
+            # `unpack_component` verifies the tarball while extracting it.
+            verify_download=False,
         )
 
 
+def download_components(tarballs_download_info, verbose):
+    """Download all the given components that are not in the cache yet
+
+    The components are fetched concurrently. curl's progress bars would garble
+    each other in that case, so they are replaced by one line per finished
+    component. In verbose mode, or if there is only one component to fetch,
+    the downloads happen serially with the usual progress bar instead.
+    """
+    pending = [
+        download_info
+        for download_info in tarballs_download_info
+        if download_info.needs_download()
+    ]
+    if verbose or len(pending) < 2:
+        for download_info in pending:
+            download_component(download_info)
+        return
+
+    lock = threading.Lock()
+    finished = 0
+
+    def download_and_report(download_info):
+        nonlocal finished
+        download_component(download_info, progress_bar=False)
+        with lock:
+            finished += 1
+            eprint(
+                "downloaded {} ({}/{})".format(
+                    os.path.basename(download_info.tarball_path),
+                    finished,
+                    len(pending),
+                )
+            )
+
+    with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+        futures = [
+            executor.submit(download_and_report, download_info)
+            for download_info in pending
+        ]
+        # Re-raise the first failure, if any, in the main thread.
+        for future in futures:
+            future.result()
+
+
 def unpack_component(download_info):
-    unpack(
-        download_info.tarball_path,
-        download_info.tarball_suffix,
-        download_info.bin_root,
-        match=download_info.pattern,
-        verbose=download_info.verbose,
+    """Install the component into its `bin_root`
+
+    If the component has a store entry, it's extracted there unless another
+    build already did so, and `bin_root` gets hard links to its files.
+
+    Returns the number of files extracted from the tarball.
+    """
+    with trace.phase("unpack", component=download_info.pattern):
+        return _unpack_component(download_info)
+
+
+def _unpack_component(download_info):
+    checksum = download_info.stage0_data.get(download_info.download_path)
+    entry = download_info.store_entry()
+    if entry is None:
+        return unpack(
+            download_info.tarball_path,
+            download_info.tarball_suffix,
+            download_info.bin_root,
+            match=download_info.pattern,
+            verbose=download_info.verbose,
+            checksum=checksum,
+        )
+
+    count = 0
+    if not os.path.isdir(entry):
+        # Extract to a temporary directory first, so that other builds never
+        # see a partially extracted entry.
+        tmp_entry = "{}.tmp{}".format(entry, os.getpid())
+        try:
+            os.makedirs(tmp_entry)
+            count = unpack(
+                download_info.tarball_path,
+                download_info.tarball_suffix,
+                tmp_entry,
+                match=download_info.pattern,
+                verbose=download_info.verbose,
+                checksum=checksum,
+            )
+            try:
+                os.rename(tmp_entry, entry)
+            except OSError:
+                # Another build finished extracting the same tarball first.
+                if not os.path.isdir(entry):
+                    raise
+        finally:
+            if os.path.exists(tmp_entry):
+                shutil.rmtree(tmp_entry)
+    # Mark the entry as recently used, see `collect_store_garbage`.
+    os.utime(entry, None)
+    link_tree(entry, download_info.bin_root)
+    return count
+
+
+def link_tree(src, dst):
+    """Recreate the tree `src` in `dst` with hard links to the files of `src`
+
+    Files are copied if hard links are not supported, e.g. because `src` and
+    `dst` are on different filesystems.
+    """
+    for root, dirs, files in os.walk(src):
+        dst_root = os.path.join(dst, os.path.relpath(root, src))
+        # Components sharing directories, like `lib`, are linked concurrently.
+        os.makedirs(dst_root, exist_ok=True)
+        for name in dirs + files:
+            src_path = os.path.join(root, name)
+            dst_path = os.path.join(dst_root, name)
+            if os.path.islink(src_path):
+                if os.path.lexists(dst_path):
+                    os.unlink(dst_path)
+                os.symlink(os.readlink(src_path), dst_path)
+            elif name in files:
+                if os.path.lexists(dst_path):
+                    os.unlink(dst_path)
+                try:
+                    os.link(src_path, dst_path)
+                except OSError:
+                    shutil.copy2(src_path, dst_path)
+
+
+def tree_files(path):
+    """Return the files and symlinks in the tree `path`, relative to it"""
+    files = []
+    for root, dirs, names in os.walk(path):
+        links = [name for name in dirs if os.path.islink(os.path.join(root, name))]
+        for name in names + links:
+            files.append(os.path.relpath(os.path.join(root, name), path))
+    return sorted(files)
+
+
+def remove_files(root, files):
+    """Remove `files`, relative to `root`, and the directories this leaves empty"""
+    dirs = set()
+    for name in files:
+        path = os.path.join(root, name)
+        if os.path.lexists(path):
+            os.unlink(path)
+        dirs.add(os.path.dirname(path))
+    # Deeper directories first, so that their parents are empty when it's
+    # their turn.
+    for path in sorted(dirs, key=len, reverse=True):
+        while path != root and os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+            path = os.path.dirname(path)
+
+
+def component_installed(bin_root, installed, checksum):
+    """Whether the component in the manifest entry `installed` is complete and
+    was installed from the tarball with the given checksum
+    """
+    if installed is None or checksum is None or installed["checksum"] != checksum:
+        return False
+    return all(
+        os.path.lexists(os.path.join(bin_root, name)) for name in installed["files"]
     )
 
 
+def is_linked(path):
+    """Whether any file in the tree `path` has other hard links"""
+    for root, _, files in os.walk(path):
+        for name in files:
+            if os.lstat(os.path.join(root, name)).st_nlink > 1:
+                return True
+    return False
+
+
+def collect_store_garbage(store_dir, keep, verbose=False):
+    """Remove the store entries that no build links to anymore
+
+    Hard link counts tell which entries are in use. Since a build removes its
+    links just before recreating them, entries are only removed a day after
+    they were last used.
+    """
+    if not os.path.isdir(store_dir):
+        return
+    for name in os.listdir(store_dir):
+        entry = os.path.join(store_dir, name)
+        if name in keep or time() - os.path.getmtime(entry) < 24 * 60 * 60:
+            continue
+        if not is_linked(entry):
+            if verbose:
+                eprint("removing unused stage0 store entry", entry)
+            shutil.rmtree(entry)
+
+
+def unshare(path):
+    """Replace `path` with a copy of itself if it has other hard links
+
+    This must be done before modifying a file in place that might have been
+    linked from the stage0 store.
+    """
+    if os.path.exists(path) and os.stat(path).st_nlink > 1:
+        tmp_path = path + ".tmp"
+        shutil.copy2(path, tmp_path)
+        os.rename(tmp_path, path)
+
+
+def replace_with_link(src, dst):
+    """Replace `dst` with a hard link to `src`, or a copy if that fails"""
+    tmp_path = dst + ".tmp"
+    if os.path.lexists(tmp_path):
+        os.unlink(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.rename(tmp_path, dst)
+
+
 class FakeArgs:
     """Used for unit tests to avoid updating all call sites"""
 
@@ -571,7 +1547,8 @@ class RustBuild(object):
         self.build_dir = os.path.abspath(build_dir)
 
         self.stage0_data = parse_stage0_file(
-            os.path.join(self.rust_root, "src", "stage0")
+            os.path.join(self.rust_root, "src", "stage0"),
+            os.path.join(self.build_dir, "cache", "stage0.marshal"),
         )
         self.stage0_compiler = Stage0Toolchain(
             self.stage0_data["compiler_date"], self.stage0_data["compiler_version"]
@@ -589,8 +1566,9 @@ class RustBuild(object):
         tarball which has the stage0 compiler used to then bootstrap the Rust
         compiler itself.
 
-        Each downloaded tarball is extracted, after that, the script
-        will move all the content to the right place.
+        Each downloaded tarball is extracted once into a store in the cache
+        directory, after that, the script links all the content to the right
+        place.
         """
         rustc_channel = self.stage0_compiler.version
         bin_root = self.bin_root()
@@ -605,27 +1583,6 @@ class RustBuild(object):
         )
 
         if need_rustc or need_cargo:
-            if os.path.exists(bin_root):
-                # HACK: On Windows, we can't delete rust-analyzer-proc-macro-server while it's
-                # running. Kill it.
-                if platform_is_win32():
-                    print(
-                        "Killing rust-analyzer-proc-macro-srv before deleting stage0 toolchain"
-                    )
-                    regex = "{}\\\\(host|{})\\\\stage0\\\\libexec".format(
-                        os.path.basename(self.build_dir), self.build
-                    )
-                    script = (
-                        # NOTE: can't use `taskkill` or `Get-Process -Name` because they error if
-                        # the server isn't running.
-                        "Get-Process | "
-                        + 'Where-Object {$_.Name -eq "rust-analyzer-proc-macro-srv"} |'
-                        + 'Where-Object {{$_.Path -match "{}"}} |'.format(regex)
-                        + "Stop-Process"
-                    )
-                    run_powershell([script])
-                shutil.rmtree(bin_root)
-
             cache_dst = self.get_toml("bootstrap-cache-path", "build") or os.path.join(
                 self.build_dir, "cache"
             )
@@ -634,11 +1591,7 @@ class RustBuild(object):
             if not os.path.exists(rustc_cache):
                 os.makedirs(rustc_cache)
 
-            tarball_suffix = ".tar.gz" if lzma is None else ".tar.xz"
-
-            toolchain_suffix = "{}-{}{}".format(
-                rustc_channel, self.build, tarball_suffix
-            )
+            toolchain_suffix = "{}-{}".format(rustc_channel, self.build)
 
             tarballs_to_download = []
 
@@ -658,73 +1611,143 @@ class RustBuild(object):
                     ("cargo-{}".format(toolchain_suffix), "cargo")
                 )
 
-            tarballs_download_info = [
-                DownloadInfo(
-                    base_download_url=self.download_url,
-                    download_path="dist/{}/{}".format(
-                        self.stage0_compiler.date, filename
-                    ),
-                    bin_root=self.bin_root(),
-                    tarball_path=os.path.join(rustc_cache, filename),
-                    tarball_suffix=tarball_suffix,
-                    stage0_data=self.stage0_data,
-                    pattern=pattern,
-                    verbose=self.verbose,
+            store_dir = os.path.join(cache_dst, "stage0-store")
+            tarballs_download_info = []
+            for name, pattern in tarballs_to_download:
+                download_path = "dist/{}/{}".format(self.stage0_compiler.date, name)
+                suffix = tarball_suffix(self.stage0_data, download_path)
+                tarballs_download_info.append(
+                    DownloadInfo(
+                        base_download_url=self.download_url,
+                        download_path=download_path + suffix,
+                        bin_root=self.bin_root(),
+                        tarball_path=os.path.join(rustc_cache, name + suffix),
+                        tarball_suffix=suffix,
+                        stage0_data=self.stage0_data,
+                        pattern=pattern,
+                        verbose=self.verbose,
+                        store_dir=store_dir,
+                    )
                 )
-                for filename, pattern in tarballs_to_download
-            ]
 
-            # Download the components serially to show the progress bars properly.
-            for download_info in tarballs_download_info:
-                download_component(download_info)
-
-            # Unpack the tarballs in parallle.
-            # In Python 2.7, Pool cannot be used as a context manager.
-            pool_size = min(len(tarballs_download_info), get_cpus())
-            if self.verbose:
-                print(
-                    "Choosing a pool size of",
-                    pool_size,
-                    "for the unpacking of the tarballs",
+            # Only replace the components whose tarball changed since they were
+            # installed, unless there is no record of what was installed.
+            manifest = self.read_stage0_manifest()
+            outdated = [
+                info
+                for info in tarballs_download_info
+                if not component_installed(
+                    bin_root,
+                    manifest.get(info.pattern),
+                    info.stage0_data.get(info.download_path),
                 )
-            p = Pool(pool_size)
-            try:
+            ]
+            if outdated and os.path.exists(bin_root):
+                # HACK: On Windows, we can't delete rust-analyzer-proc-macro-server while it's
+                # running. Kill it.
+                if platform_is_win32():
+                    print(
+                        "Killing rust-analyzer-proc-macro-srv before deleting stage0 toolchain"
+                    )
+                    regex = "{}\\\\(host|{})\\\\stage0\\\\libexec".format(
+                        os.path.basename(self.build_dir), self.build
+                    )
+                    script = (
+                        # NOTE: can't use `taskkill` or `Get-Process -Name` because they error if
+                        # the server isn't running.
+                        "Get-Process | "
+                        + 'Where-Object {$_.Name -eq "rust-analyzer-proc-macro-srv"} |'
+                        + 'Where-Object {{$_.Path -match "{}"}} |'.format(regex)
+                        + "Stop-Process"
+                    )
+                    run_powershell([script])
+                if not manifest:
+                    shutil.rmtree(bin_root)
+                for info in outdated:
+                    if info.pattern in manifest:
+                        if self.verbose:
+                            eprint("removing outdated stage0 component", info.pattern)
+                        remove_files(bin_root, manifest.pop(info.pattern)["files"])
+
+            with trace.phase("download components"):
+                download_components(outdated, self.verbose)
+
+            if outdated:
                 # FIXME: A cheap workaround for https://github.com/rust-lang/rust/issues/125578,
                 # remove this once the issue is closed.
                 bootstrap_build_artifacts = os.path.join(self.bootstrap_out(), "debug")
                 if os.path.exists(bootstrap_build_artifacts):
                     shutil.rmtree(bootstrap_build_artifacts)
 
-                p.map(unpack_component, tarballs_download_info)
-            finally:
-                p.close()
-            p.join()
-
-            if self.should_fix_bins_and_dylibs():
-                self.fix_bin_or_dylib("{}/bin/cargo".format(bin_root))
-
-                self.fix_bin_or_dylib("{}/bin/rustc".format(bin_root))
-                self.fix_bin_or_dylib("{}/bin/rustdoc".format(bin_root))
-                self.fix_bin_or_dylib(
-                    "{}/libexec/rust-analyzer-proc-macro-srv".format(bin_root)
+                # Unpack the tarballs in parallel. Decompressing and writing the
+                # files release the GIL, so threads are enough for this.
+                pool_size = min(len(outdated), get_cpus())
+                if self.verbose:
+                    print(
+                        "Choosing a pool size of",
+                        pool_size,
+                        "for the unpacking of the tarballs",
+                    )
+                with trace.phase("unpack components"):
+                    with ThreadPoolExecutor(max_workers=pool_size) as executor:
+                        extracted = list(executor.map(unpack_component, outdated))
+                trace.count("files extracted", sum(extracted))
+
+            updated = []
+            for info in outdated:
+                files = tree_files(info.store_entry())
+                manifest[info.pattern] = {
+                    "checksum": info.stage0_data.get(info.download_path),
+                    "files": files,
+                }
+                updated.extend(files)
+            with output(self.stage0_manifest()) as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+
+            in_use = [info.store_entry() for info in tarballs_download_info]
+            with trace.phase("collect store garbage"):
+                collect_store_garbage(
+                    store_dir,
+                    keep=[os.path.basename(entry) for entry in in_use if entry],
+                    verbose=self.verbose,
                 )
-                lib_dir = "{}/lib".format(bin_root)
-                rustlib_bin_dir = "{}/rustlib/{}/bin".format(lib_dir, self.build)
-                self.fix_bin_or_dylib("{}/rust-lld".format(rustlib_bin_dir))
-                self.fix_bin_or_dylib("{}/gcc-ld/ld.lld".format(rustlib_bin_dir))
-                for lib in os.listdir(lib_dir):
-                    # .so is not necessarily the suffix, there can be version numbers afterwards.
-                    if ".so" in lib:
-                        elf_path = os.path.join(lib_dir, lib)
-                        with open(elf_path, "rb") as f:
-                            magic = f.read(4)
-                            # Patchelf will skip non-ELF files, but issue a warning.
-                            if magic == b"\x7fELF":
-                                self.fix_bin_or_dylib(elf_path)
+
+            if updated and self.should_fix_bins_and_dylibs():
+                with trace.phase("patch binaries"):
+                    self.fix_bins_and_dylibs(
+                        bin_root, os.path.join(cache_dst, "stage0-patched"), updated
+                    )
 
             with output(self.rustc_stamp()) as rust_stamp:
                 rust_stamp.write(key)
 
+    def stage0_manifest(self):
+        """Return the path of the record of the components installed in `bin_root`
+
+        >>> rb = RustBuild()
+        >>> rb.build = "host"
+        >>> rb.build_dir = "build"
+        >>> expected = os.path.join("build", "host", "stage0", ".stage0-manifest.json")
+        >>> assert rb.stage0_manifest() == expected, rb.stage0_manifest()
+        """
+        return os.path.join(self.bin_root(), ".stage0-manifest.json")
+
+    def read_stage0_manifest(self):
+        """Return the checksum and files of each component installed in `bin_root`
+
+        The result is empty if nothing was installed, or `bin_root` predates the
+        manifest or has an unreadable one, e.g. because writing it was
+        interrupted. In those cases it has to be replaced as a whole.
+        """
+        if self.clean:
+            return {}
+        try:
+            with open(self.stage0_manifest()) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
     def should_fix_bins_and_dylibs(self):
         """Whether or not `fix_bin_or_dylib` needs to be run; can only be True
         on NixOS or if bootstrap.toml has `build.patch-binaries-for-nix` set.
@@ -786,18 +1809,61 @@ class RustBuild(object):
             eprint("INFO: You seem to be using Nix.")
         return answer
 
-    def fix_bin_or_dylib(self, fname):
-        """Modifies the interpreter section of 'fname' to fix the dynamic linker,
-        or the RPATH section, to fix the dynamic library search path
+    def fix_bins_and_dylibs(self, bin_root, cache_dir=None, updated=None):
+        """Run `fix_bin_or_dylib` on every ELF file of the stage0 toolchain
 
-        This method is only required on NixOS and uses the PatchELF utility to
-        change the interpreter/RPATH of ELF executables.
+        patchelf runs in a separate process for each file, so the files are
+        patched in parallel. With a `cache_dir`, patched files are kept there
+        and reused for identical files of later builds.
 
-        Please see https://nixos.org/patchelf.html for more information
+        If `updated` is given, only the files in it, relative to `bin_root`, are
+        patched; the others were patched when they were installed.
         """
-        assert self._should_fix_bins_and_dylibs is True
-        eprint("attempting to patch", fname)
+        fnames = [
+            "{}/bin/cargo".format(bin_root),
+            "{}/bin/rustc".format(bin_root),
+            "{}/bin/rustdoc".format(bin_root),
+            "{}/libexec/rust-analyzer-proc-macro-srv".format(bin_root),
+        ]
+        lib_dir = "{}/lib".format(bin_root)
+        rustlib_bin_dir = "{}/rustlib/{}/bin".format(lib_dir, self.build)
+        fnames.append("{}/rust-lld".format(rustlib_bin_dir))
+        fnames.append("{}/gcc-ld/ld.lld".format(rustlib_bin_dir))
+        for lib in os.listdir(lib_dir):
+            # .so is not necessarily the suffix, there can be version numbers afterwards.
+            if ".so" in lib:
+                elf_path = os.path.join(lib_dir, lib)
+                with open(elf_path, "rb") as f:
+                    magic = f.read(4)
+                    # Patchelf will skip non-ELF files, but issue a warning.
+                    if magic == b"\x7fELF":
+                        fnames.append(elf_path)
+        if updated is not None:
+            updated = set(os.path.normpath(name) for name in updated)
+            fnames = [
+                fname
+                for fname in fnames
+                if os.path.normpath(os.path.relpath(fname, bin_root)) in updated
+            ]
+
+        # Build `.nix-deps` before patching anything in parallel.
+        if self.nix_deps() is None:
+            return
+        with ThreadPoolExecutor(max_workers=get_cpus()) as executor:
+            used = list(
+                executor.map(
+                    lambda fname: self.fix_bin_or_dylib(fname, cache_dir), fnames
+                )
+            )
+        if cache_dir is not None:
+            collect_store_garbage(
+                cache_dir, keep=[key for key in used if key], verbose=self.verbose
+            )
 
+    def nix_deps(self):
+        """Return the `.nix-deps` directory with the dependencies used to patch
+        the stage0 binaries, or None if it could not be built
+        """
         # Only build `.nix-deps` once.
         nix_deps_dir = self.nix_deps_dir
         if not nix_deps_dir:
@@ -836,8 +1902,29 @@ class RustBuild(object):
                 )
             except subprocess.CalledProcessError as reason:
                 eprint("WARNING: failed to call nix-build:", reason)
-                return
+                return None
             self.nix_deps_dir = nix_deps_dir
+        return nix_deps_dir
+
+    def fix_bin_or_dylib(self, fname, cache_dir=None):
+        """Modifies the interpreter section of 'fname' to fix the dynamic linker,
+        or the RPATH section, to fix the dynamic library search path
+
+        This method is only required on NixOS and uses the PatchELF utility to
+        change the interpreter/RPATH of ELF executables.
+
+        Please see https://nixos.org/patchelf.html for more information
+
+        If `cache_dir` is given, the patched file is looked up there by the
+        hash of the unpatched file and the patchelf arguments, and added to it
+        after patching. Returns the name of the cache entry, if any.
+        """
+        assert self._should_fix_bins_and_dylibs is True
+        eprint("attempting to patch", fname)
+
+        nix_deps_dir = self.nix_deps()
+        if nix_deps_dir is None:
+            return None
 
         patchelf = "{}/bin/patchelf".format(nix_deps_dir)
         rpath_entries = [os.path.join(os.path.realpath(nix_deps_dir), "lib")]
@@ -849,11 +1936,48 @@ class RustBuild(object):
             ) as dynamic_linker:
                 patchelf_args += ["--set-interpreter", dynamic_linker.read().rstrip()]
 
+        key = None
+        if cache_dir is not None and os.path.isfile(fname):
+            key = hashlib.sha256(
+                json.dumps([sha256_file(fname), patchelf_args]).encode("utf-8")
+            ).hexdigest()
+            entry = os.path.join(cache_dir, key)
+            patched = os.path.join(entry, os.path.basename(fname))
+            if os.path.exists(patched):
+                if self.verbose:
+                    eprint("using patched", patched)
+                # Mark the entry as recently used, see `collect_store_garbage`.
+                os.utime(entry, None)
+                replace_with_link(patched, fname)
+                trace.count("patched files reused")
+                return key
+
+        # patchelf modifies the file in place, don't let that reach the store.
+        unshare(fname)
         try:
             subprocess.check_output([patchelf] + patchelf_args + [fname])
         except subprocess.CalledProcessError as reason:
             eprint("WARNING: failed to call patchelf:", reason)
-            return
+            return None
+        trace.count("files patched")
+
+        if key is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_entry = tempfile.mkdtemp(dir=cache_dir)
+            try:
+                replace_with_link(
+                    fname, os.path.join(tmp_entry, os.path.basename(fname))
+                )
+                os.rename(tmp_entry, entry)
+            except OSError:
+                # Another build patched the same file first.
+                if not os.path.isdir(entry):
+                    raise
+            finally:
+                if os.path.exists(tmp_entry):
+                    shutil.rmtree(tmp_entry)
+        return key
 
     def rustc_stamp(self):
         """Return the path for .rustc-stamp at the given stage
@@ -911,22 +2035,52 @@ class RustBuild(object):
         >>> rb.get_toml("key1")
         'true'
         """
-        return RustBuild.get_toml_static(self.config_toml, key, section)
+        if self._toml_index is None:
+            self._toml_index = RustBuild.index_toml(self.config_toml)
+        return self._toml_index.get((section, key))
+
+    @property
+    def config_toml(self):
+        return self._config_toml
+
+    @config_toml.setter
+    def config_toml(self, config_toml):
+        self._config_toml = config_toml
+        self._toml_index = None
 
     @staticmethod
     def get_toml_static(config_toml, key, section=None):
+        return RustBuild.index_toml(config_toml).get((section, key))
+
+    @staticmethod
+    def index_toml(config_toml):
+        """Index every `key = value` line by `(section, key)`
+
+        The config isn't parsed as real TOML, since the profile defaults
+        appended to it repeat tables. Like a linear search, only the first
+        value for a key is kept, both within its section and under
+        `(None, key)`, which matches any section.
+
+        >>> index = RustBuild.index_toml('a = 1\\n[b]\\na = "2"\\nc=3\\n[b]\\nc = 4')
+        >>> index[None, 'a'], index['b', 'a'], index['b', 'c']
+        ('1', '2', '3')
+        """
+        index = {}
         cur_section = None
         for line in config_toml.splitlines():
             section_match = re.match(r"^\s*\[(.*)\]\s*$", line)
             if section_match is not None:
                 cur_section = section_match.group(1)
 
-            match = re.match(r"^{}\s*=(.*)$".format(key), line)
-            if match is not None:
-                value = match.group(1)
-                if section is None or section == cur_section:
-                    return RustBuild.get_string(value) or value.strip()
-        return None
+            key, eq, value = line.partition("=")
+            if not eq or key[:1].isspace():
+                continue
+            key = key.rstrip()
+            value = RustBuild.get_string(value) or value.strip()
+            index.setdefault((None, key), value)
+            if cur_section is not None:
+                index.setdefault((cur_section, key), value)
+        return index
 
     def cargo(self):
         """Return config path for cargo"""
@@ -999,7 +2153,11 @@ class RustBuild(object):
         return os.path.join(self.bootstrap_out(), "debug", "bootstrap")
 
     def build_bootstrap(self):
-        """Build bootstrap"""
+        """Build bootstrap
+
+        Returns the cargo command line and the environment variables it was
+        run with that differ from ours, to be recorded with the fingerprint.
+        """
         env = os.environ.copy()
         if "GITHUB_ACTIONS" in env:
             print("::group::Building bootstrap")
@@ -1013,6 +2171,15 @@ class RustBuild(object):
         if "GITHUB_ACTIONS" in env:
             print("::endgroup::")
 
+        return {
+            "args": args,
+            "env": dict(
+                (key, value)
+                for key, value in env.items()
+                if os.environ.get(key) != value
+            ),
+        }
+
     def build_bootstrap_cmd(self, env):
         """For tests."""
         build_dir = os.path.join(self.build_dir, "bootstrap")
@@ -1153,6 +2320,135 @@ class RustBuild(object):
 
         return args
 
+    def bootstrap_fingerprint(self, env):
+        """Describe everything the result of `build_bootstrap` depends on
+
+        If this is the same as when bootstrap was last built, cargo has
+        nothing to do, and running it can be skipped.
+        """
+        sources = {}
+        for source_dir in ["bootstrap", "build_helper"]:
+            source_root = os.path.join(self.rust_root, "src")
+            for root, dirs, files in os.walk(os.path.join(source_root, source_dir)):
+                dirs[:] = [d for d in dirs if d != "__pycache__"]
+                for name in files:
+                    path = os.path.join(root, name)
+                    relpath = os.path.relpath(path, source_root).replace(os.sep, "/")
+                    sources[relpath] = file_identity(path)
+        # Anything else the last build read, e.g. through `include_str!`.
+        for path in self.bootstrap_dependencies():
+            relpath = os.path.relpath(path, source_root)
+            if relpath.startswith(os.pardir):
+                relpath = path
+            sources.setdefault(relpath.replace(os.sep, "/"), file_identity(path))
+
+        library_paths = [
+            "LD_LIBRARY_PATH",
+            "DYLD_LIBRARY_PATH",
+            "LIBRARY_PATH",
+            "LIBPATH",
+        ]
+        relevant_env = dict(
+            (key, value)
+            for key, value in env.items()
+            if key.startswith(("CARGO", "RUST", "BOOTSTRAP")) or key in library_paths
+        )
+        # `build_bootstrap_cmd` always sets this one.
+        relevant_env.pop("RUSTC_BOOTSTRAP", None)
+        # Tracing a startup shouldn't change what it does.
+        relevant_env.pop(StartupTrace.ENV_VAR, None)
+
+        # Cargo reads its configuration from the directory it runs in, all of
+        # its parents and `CARGO_HOME`.
+        cargo_config_dirs = []
+        path = self.rust_root
+        while True:
+            cargo_config_dirs.append(os.path.join(path, ".cargo"))
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        cargo_config_dirs.append(
+            env.get("CARGO_HOME") or os.path.join(os.path.expanduser("~"), ".cargo")
+        )
+        cargo_config = dict(
+            (path, file_identity(path))
+            for path in (
+                os.path.join(config_dir, name)
+                for config_dir in cargo_config_dirs
+                for name in ["config", "config.toml"]
+            )
+            if os.path.exists(path)
+        )
+
+        return {
+            # Bootstrap finds the source tree through `CARGO_MANIFEST_DIR`.
+            "rust_root": self.rust_root,
+            "build": self.build,
+            "config": hashlib.sha256(self.config_toml.encode("utf-8")).hexdigest(),
+            "cargo config": cargo_config,
+            "sources": sources,
+            "rustc": [self.rustc(), file_identity(self.rustc())],
+            "cargo": [self.cargo(), file_identity(self.cargo())],
+            "env": relevant_env,
+            "vendor": self.use_vendored_sources,
+            "warnings": self.warnings,
+        }
+
+    def bootstrap_dependencies(self):
+        """Return the files the last build of bootstrap depended on
+
+        They are read from the dep-info file cargo writes next to the binary,
+        which lists one target per line followed by its dependencies, with
+        the spaces in paths escaped.
+        """
+        try:
+            with open(self.bootstrap_binary() + ".d") as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            return []
+        dependencies = []
+        for line in lines:
+            _, _, deps = line.partition(": ")
+            dependencies.extend(
+                dep.replace("\\ ", " ") for dep in re.split(r"(?<!\\) ", deps) if dep
+            )
+        return dependencies
+
+    def bootstrap_fingerprint_path(self):
+        return os.path.join(self.bootstrap_out(), "fingerprint.json")
+
+    def bootstrap_up_to_date(self, fingerprint):
+        """Whether the bootstrap binary was built with the given fingerprint"""
+        if self.clean:
+            return False
+        recorded = self.read_bootstrap_fingerprint()
+        if recorded is None:
+            return False
+        binary = file_identity(self.bootstrap_binary())
+        return (
+            recorded.get("inputs") == fingerprint and recorded.get("binary") == binary
+        )
+
+    def read_bootstrap_fingerprint(self):
+        try:
+            with open(self.bootstrap_fingerprint_path()) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def record_bootstrap_fingerprint(self, fingerprint, command=None):
+        with output(self.bootstrap_fingerprint_path()) as f:
+            json.dump(
+                {
+                    "inputs": fingerprint,
+                    "binary": file_identity(self.bootstrap_binary()),
+                    "command": command,
+                },
+                f,
+                sort_keys=True,
+            )
+
     def build_triple(self):
         """Build triple as in LLVM
 
@@ -1198,11 +2494,13 @@ class RustBuild(object):
                 eprint("      use vendored sources by default.")
 
         cargo_dir = os.path.join(self.rust_root, ".cargo")
-        commit = self.get_latest_commit()
-        url = f"https://ci-artifacts.rust-lang.org/rustc-builds/{commit}/rustc-nightly-src.tar.xz"
         if self.use_vendored_sources:
             vendor_dir = os.path.join(self.rust_root, "vendor")
             if not os.path.exists(vendor_dir):
+                # Only needed for the error message, and `git rev-list` is slow
+                # enough in large clones that we don't want to run it every time.
+                commit = self.get_latest_commit()
+                url = f"https://ci-artifacts.rust-lang.org/rustc-builds/{commit}/rustc-nightly-src.tar.xz"
                 eprint(
                     "ERROR: vendoring required, but vendor directory does not exist."
                 )
@@ -1251,14 +2549,154 @@ def parse_args(args):
     return parser.parse_known_args(args)[0]
 
 
-def parse_stage0_file(path):
+def stage0_artifacts(stage0_data, triples, suffixes):
+    """Return the paths of the tarballs in `stage0_data` for any of `triples`
+
+    >>> stage0_data = {
+    ...     "dist_server": "https://static.rust-lang.org",
+    ...     "dist/2025-01-01/cargo-beta-x86_64-unknown-linux-gnu.tar.gz": "a",
+    ...     "dist/2025-01-01/cargo-beta-x86_64-unknown-linux-gnu.tar.xz": "b",
+    ...     "dist/2025-01-01/cargo-beta-aarch64-apple-darwin.tar.xz": "c",
+    ... }
+    >>> stage0_artifacts(stage0_data, ["x86_64-unknown-linux-gnu"], [".tar.xz"])
+    ['dist/2025-01-01/cargo-beta-x86_64-unknown-linux-gnu.tar.xz']
+    """
+    endings = tuple(
+        "-{}{}".format(triple, suffix) for triple in triples for suffix in suffixes
+    )
+    return sorted(
+        key for key in stage0_data if key.startswith("dist/") and key.endswith(endings)
+    )
+
+
+def prefetch_stage0(stage0_data, base_url, mirror, artifacts, jobs, verbose=False):
+    """Download `artifacts` from `base_url` to the same paths below `mirror`
+
+    Tarballs that are already in the mirror are only verified, which `verify`
+    remembers, so refreshing a mirror only fetches what changed. Returns the
+    artifacts that could not be fetched.
+    """
+    lock = threading.Lock()
+    finished = 0
+    failed = []
+
+    def fetch(artifact):
+        nonlocal finished
+        path = os.path.join(mirror, *artifact.split("/"))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            get(
+                base_url,
+                artifact,
+                path,
+                stage0_data,
+                verbose=verbose,
+                progress_bar=False,
+            )
+        except (Exception, SystemExit) as e:
+            eprint("ERROR: failed to fetch {}: {}".format(artifact, e))
+            with lock:
+                failed.append(artifact)
+            return
+        with lock:
+            finished += 1
+            eprint("fetched {} ({}/{})".format(artifact, finished, len(artifacts)))
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        list(executor.map(fetch, artifacts))
+    return sorted(failed)
+
+
+def prefetch_stage0_main(args):
+    """Entry point for `x.py prefetch-stage0`"""
+    parser = argparse.ArgumentParser(
+        prog="x.py prefetch-stage0",
+        description="Download the stage0 toolchains listed in src/stage0 into a "
+        "local mirror. Builds can then use it with "
+        "RUSTUP_DIST_SERVER=file://<mirror>.",
+    )
+    parser.add_argument("mirror", help="directory to mirror the tarballs into")
+    parser.add_argument(
+        "--host",
+        action="append",
+        help="host triple to fetch the toolchain for, can be given multiple "
+        "times (default: the build triple)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["zst", "xz", "gz", "all"],
+        default="xz" if lzma is not None else "gz",
+        help="which tarballs to fetch",
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=8)
+    parser.add_argument("-v", "--verbose", action="count", default=0)
+    args = parser.parse_args(args)
+
+    rust_root = os.path.abspath(os.path.join(__file__, "../../.."))
+    stage0_data = parse_stage0_file(os.path.join(rust_root, "src", "stage0"))
+    base_url = os.getenv("RUSTUP_DIST_SERVER") or stage0_data["dist_server"]
+    triples = args.host or [default_build_triple(args.verbose)]
+    suffixes = {
+        "zst": [".tar.zst"],
+        "xz": [".tar.xz"],
+        "gz": [".tar.gz"],
+        "all": [".tar.zst", ".tar.xz", ".tar.gz"],
+    }[args.format]
+
+    artifacts = stage0_artifacts(stage0_data, triples, suffixes)
+    if not artifacts:
+        eprint("ERROR: src/stage0 has no tarballs for", ", ".join(triples))
+        return 1
+    failed = prefetch_stage0(
+        stage0_data, base_url, args.mirror, artifacts, args.jobs, args.verbose
+    )
+    if failed:
+        eprint(
+            "ERROR: failed to fetch {} of {} tarballs".format(
+                len(failed), len(artifacts)
+            )
+        )
+        return 1
+    return 0
+
+
+def parse_stage0_file(path, cache_path=None):
+    """Parse src/stage0 into a dict
+
+    Checksums are keyed by the path of their tarball on the dist server, e.g.
+    "dist/2025-01-01/rustc-beta-x86_64-unknown-linux-gnu.tar.xz". The file
+    grows with every host and component, so when `cache_path` is given the
+    result is kept there and reused for as long as the file's size and
+    modification time stay the same.
+    """
+    stat = os.stat(path)
+    # The leading 1 is the version of the cache format.
+    key = (1, os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if cache_path is not None:
+        try:
+            with open(cache_path, "rb") as f:
+                cached_key, result = marshal.loads(f.read())
+            if cached_key == key:
+                return result
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
     result = {}
     with open(path, "r") as file:
         for line in file:
             line = line.strip()
             if line and not line.startswith("#"):
-                key, value = line.split("=", 1)
-                result[key.strip()] = value.strip()
+                name, value = line.split("=", 1)
+                result[name.strip()] = value.strip()
+
+    if cache_path is not None:
+        try:
+            with open(cache_path + ".tmp", "wb") as f:
+                f.write(marshal.dumps((key, result)))
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError:
+            # E.g. the build directory doesn't exist yet; the next run caches.
+            pass
     return result
 
 
@@ -1293,7 +2731,7 @@ def bootstrap(args):
     # Give a hard error if `--config` or `RUST_BOOTSTRAP_CONFIG` are set to a missing path,
     # but not if `bootstrap.toml` hasn't been created.
     if not using_default_path or os.path.exists(toml_path):
-        with open(toml_path) as config:
+        with trace.phase("read config"), open(toml_path) as config:
             config_toml = config.read()
     else:
         config_toml = ""
@@ -1327,24 +2765,46 @@ def bootstrap(args):
             config_toml += os.linesep + included_toml.read()
 
     # Configure initial bootstrap
-    build = RustBuild(config_toml, args)
-    build.check_vendored_status()
+    with trace.phase("configure"):
+        build = RustBuild(config_toml, args)
+        build.check_vendored_status()
 
     if not os.path.exists(build.build_dir):
         os.makedirs(os.path.realpath(build.build_dir))
 
     # Fetch/build the bootstrap
-    build.download_toolchain()
-    sys.stdout.flush()
-    build.build_bootstrap()
+    with trace.phase("download toolchain"):
+        build.download_toolchain()
     sys.stdout.flush()
+    with trace.phase("fingerprint"):
+        fingerprint = build.bootstrap_fingerprint(os.environ)
+        up_to_date = build.bootstrap_up_to_date(fingerprint)
+    if up_to_date:
+        if build.verbose:
+            eprint("bootstrap is up to date, not running cargo")
+    else:
+        recorded = build.read_bootstrap_fingerprint()
+        binary = file_identity(build.bootstrap_binary())
+        with trace.phase("build bootstrap"):
+            command = build.build_bootstrap()
+        sys.stdout.flush()
+        if build.verbose:
+            if build.clean:
+                changes = ["--clean was passed"]
+            else:
+                changes = fingerprint_changes(recorded, fingerprint, binary, command)
+            eprint("ran cargo to build bootstrap because of these changes:")
+            for change in changes:
+                eprint("    " + change)
+        build.record_bootstrap_fingerprint(fingerprint, command)
 
     # Run the bootstrap
     args = [build.bootstrap_binary()]
     args.extend(sys.argv[1:])
     env = os.environ.copy()
     env["BOOTSTRAP_PYTHON"] = sys.executable
-    run(args, env=env, verbose=build.verbose, is_bootstrap=True)
+    with trace.phase("run bootstrap"):
+        run(args, env=env, verbose=build.verbose, is_bootstrap=True)
 
 
 def main():
@@ -1355,6 +2815,11 @@ def main():
     if len(sys.argv) > 1 and sys.argv[1] == "help":
         sys.argv[1] = "-h"
 
+    # x.py prefetch-stage0 <mirror> ...
+    # This fetches what is needed to build bootstrap, so bootstrap can't do it.
+    if len(sys.argv) > 1 and sys.argv[1] == "prefetch-stage0":
+        sys.exit(prefetch_stage0_main(sys.argv[2:]))
+
     args = parse_args(sys.argv)
     help_triggered = args.help or len(sys.argv) == 1
 
@@ -1385,6 +2850,9 @@ def main():
             "in",
             format_build_time(time() - start_time),
         )
+    trace_path = os.environ.get(StartupTrace.ENV_VAR)
+    if trace_path:
+        trace.write(trace_path)
     sys.exit(exit_code)
 
 
@@ -0,0 +1,485 @@
+"""Bootstrap benchmarks
+
+Time the hot paths of bootstrap.py, which runs on every `x.py` invocation,
+against fixtures in a temporary directory. Run these with
+`python src/bootstrap/bootstrap_bench.py`; `--output results.json` stores the
+results, and `--baseline results.json` compares a run against stored ones.
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from shutil import rmtree, which
+from statistics import median
+from time import perf_counter, time
+from unittest.mock import patch
+
+# Allow running this from the top-level directory.
+bootstrap_dir = os.path.dirname(os.path.abspath(__file__))
+# For the import below, have Python search in src/bootstrap first.
+sys.path.insert(0, bootstrap_dir)
+import bootstrap  # noqa: E402
+import configure  # noqa: E402
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """Register a benchmark
+
+    Benchmarks take the `Fixtures` and return `(setup, run, number)`. `run` is
+    timed `number` times in a row, after calling `setup` (which may be None)
+    outside of the timing.
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+class Fixtures(object):
+    """Files and servers the benchmarks share, created on first use"""
+
+    def __init__(self, container, quick):
+        self.container = container
+        self.quick = quick
+        self.server = None
+        self.tarballs = {}
+        self.config = None
+
+    def path(self, *parts):
+        return os.path.join(self.container, *parts)
+
+    def config_toml(self):
+        """A bootstrap.toml as written by configure, with a profile merged in"""
+        if self.config is not None:
+            return self.config
+        with patch("configure.p"):
+            section_order, sections, targets = configure.parse_args(
+                [
+                    "--set",
+                    "profile=compiler",
+                    "--enable-full-tools",
+                    "--enable-ccache",
+                    "--set",
+                    "rust.debug-assertions=true",
+                    "--target",
+                    "x86_64-unknown-linux-gnu,aarch64-unknown-linux-gnu",
+                ]
+            )
+        buffer = io.StringIO()
+        configure.write_config_toml(buffer, section_order, targets, sections)
+        # As `bootstrap()` does it: the defaults of the profile come last.
+        defaults = os.path.join(bootstrap_dir, "defaults", "bootstrap.compiler.toml")
+        with open(defaults) as f:
+            self.config = buffer.getvalue() + os.linesep + f.read()
+        return self.config
+
+    def big_file(self):
+        path = self.path("big-file")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                for _ in range(8 if self.quick else 64):
+                    f.write(os.urandom(1024 * 1024))
+        return path
+
+    def tarball(self, suffix):
+        """A component tarball with thousands of small files, like rust-std"""
+        if suffix in self.tarballs:
+            return self.tarballs[suffix]
+        path = self.path("rust-std-beta-host" + suffix)
+        tar_path = self.path("rust-std-beta-host.tar")
+        mode = {".tar.gz": "w:gz", ".tar.xz": "w:xz", ".tar.zst": "w"}[suffix]
+        with tarfile.open(path if mode != "w" else tar_path, mode) as tar:
+            for i in range(500 if self.quick else 5000):
+                name = "rust-std-beta-host/rust-std-host/lib/{}/file{}.rlib".format(
+                    i % 50, i
+                )
+                content = ("{}\n".format(i) * 200).encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        if suffix == ".tar.zst":
+            subprocess.check_call(["zstd", "-q", "-f", "--rm", tar_path, "-o", path])
+        self.tarballs[suffix] = (path, bootstrap.sha256_file(path))
+        return self.tarballs[suffix]
+
+    def serve(self):
+        """Serve the container over HTTP, like the dist server"""
+        if self.server is None:
+            container = self.container
+
+            class Handler(SimpleHTTPRequestHandler):
+                protocol_version = "HTTP/1.1"
+                # Headers and body are written separately, don't let Nagle's
+                # algorithm hold back the body of a kept-alive connection.
+                disable_nagle_algorithm = True
+
+                def __init__(self, *args):
+                    SimpleHTTPRequestHandler.__init__(self, *args, directory=container)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+            threading.Thread(
+                target=self.server.serve_forever, args=(0.01,), daemon=True
+            ).start()
+        return "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+BOOTSTRAP_KEYS = [
+    ("build-dir", "build"),
+    ("vendor", "build"),
+    ("locked-deps", "build"),
+    ("verbose", "build"),
+    ("bootstrap-cache-path", "build"),
+    ("rustc", "build"),
+    ("cargo", "build"),
+    ("patch-binaries-for-nix", "build"),
+    ("download-ci-llvm", "llvm"),
+    ("profile", None),
+]
+
+
+@benchmark
+def get_toml(fixtures):
+    """The lookups bootstrap.py makes, in a config it has already indexed"""
+    build = bootstrap.RustBuild(fixtures.config_toml())
+
+    def run():
+        for key, section in BOOTSTRAP_KEYS:
+            build.get_toml(key, section)
+
+    return None, run, 1000
+
+
+@benchmark
+def get_toml_fresh_config(fixtures):
+    """The same lookups, including indexing the config first"""
+    config_toml = fixtures.config_toml()
+    build = bootstrap.RustBuild(config_toml)
+
+    def run():
+        build.config_toml = config_toml
+        for key, section in BOOTSTRAP_KEYS:
+            build.get_toml(key, section)
+
+    return None, run, 100
+
+
+@benchmark
+def parse_stage0_file(fixtures):
+    """Reading src/stage0, from the cache in the build directory"""
+    stage0 = os.path.join(bootstrap_dir, "..", "stage0")
+    cache = fixtures.path("stage0.marshal")
+
+    def run():
+        bootstrap.parse_stage0_file(stage0, cache)
+
+    return None, run, 100
+
+
+@benchmark
+def verify(fixtures):
+    """Hashing a tarball that was just downloaded"""
+    path = fixtures.big_file()
+    expected = bootstrap.sha256_file(path)
+
+    def run():
+        assert bootstrap.verify(path, expected, False, use_cache=False)
+
+    return None, run, 1
+
+
+def unpack_benchmark(suffix):
+    def unpack(fixtures):
+        tarball, checksum = fixtures.tarball(suffix)
+        dst = fixtures.path("unpacked")
+
+        def setup():
+            if os.path.exists(dst):
+                rmtree(dst)
+            os.mkdir(dst)
+            if os.path.exists(bootstrap.verified_stamp(tarball)):
+                os.unlink(bootstrap.verified_stamp(tarball))
+
+        def run():
+            bootstrap.unpack(
+                tarball, suffix, dst, match="rust-std-host", checksum=checksum
+            )
+
+        return setup, run, 1
+
+    unpack.__name__ = "unpack_" + suffix.rpartition(".")[2]
+    unpack.__doc__ = "Extracting and verifying a {} component".format(suffix)
+    return unpack
+
+
+benchmark(unpack_benchmark(".tar.gz"))
+benchmark(unpack_benchmark(".tar.xz"))
+if bootstrap.zstd_available() and which("zstd"):
+    benchmark(unpack_benchmark(".tar.zst"))
+
+
+def unpack_components_benchmark(name, executor):
+    def unpack_components(fixtures):
+        tarball, checksum = fixtures.tarball(".tar.xz")
+        infos = []
+        for i in range(3):
+            component = fixtures.path("components", str(i))
+            if not os.path.isdir(component):
+                os.makedirs(component)
+            tarball_path = os.path.join(component, os.path.basename(tarball))
+            if not os.path.exists(tarball_path):
+                os.link(tarball, tarball_path)
+            infos.append(
+                bootstrap.DownloadInfo(
+                    base_download_url=None,
+                    download_path="rust-std-beta-host.tar.xz",
+                    bin_root=os.path.join(component, "stage0"),
+                    tarball_path=tarball_path,
+                    tarball_suffix=".tar.xz",
+                    stage0_data={"rust-std-beta-host.tar.xz": checksum},
+                    pattern="rust-std-host",
+                    verbose=False,
+                )
+            )
+
+        def setup():
+            for info in infos:
+                if os.path.exists(info.bin_root):
+                    rmtree(info.bin_root)
+                os.mkdir(info.bin_root)
+                if os.path.exists(bootstrap.verified_stamp(info.tarball_path)):
+                    os.unlink(bootstrap.verified_stamp(info.tarball_path))
+
+        def run():
+            with executor(len(infos)) as pool:
+                list(pool.map(bootstrap.unpack_component, infos))
+
+        return setup, run, 1
+
+    unpack_components.__name__ = "unpack_components_" + name
+    unpack_components.__doc__ = "Unpacking three components with a {}".format(
+        executor.__name__
+    )
+    return unpack_components
+
+
+# How `download_toolchain` unpacks the components, and how it used to.
+benchmark(unpack_components_benchmark("threads", ThreadPoolExecutor))
+benchmark(unpack_components_benchmark("pool", Pool))
+
+
+def configure_benchmark(count):
+    def classify_args(fixtures):
+        args = []
+        for option in configure.options:
+            if option.value:
+                args.append("--{}=value".format(option.name))
+            else:
+                args.append("--enable-" + option.name)
+        args = (args * (count // len(args) + 1))[:count]
+
+        def run():
+            configure.classify_args(args)
+
+        return None, run, 10
+
+    classify_args.__name__ = "configure_args_{}".format(count)
+    classify_args.__doc__ = "Sorting {} ./configure arguments".format(count)
+    return classify_args
+
+
+for count in [10, 100, 1000]:
+    benchmark(configure_benchmark(count))
+
+
+@benchmark
+def download(fixtures):
+    """Downloading and verifying a tarball from a local dist server"""
+    tarball, checksum = fixtures.tarball(".tar.xz")
+    url = os.path.basename(tarball)
+    base = fixtures.serve()
+    dst = fixtures.path("downloaded.tar.xz")
+
+    def setup():
+        for path in [dst, bootstrap.verified_stamp(dst)]:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def run():
+        bootstrap.get(base, url, dst, {url: checksum}, progress_bar=False)
+
+    return setup, run, 1
+
+
+@benchmark
+def noop_startup(fixtures):
+    """A whole `x.py` run that finds stage0 and bootstrap up to date
+
+    This includes starting Python, but not what the bootstrap binary does,
+    which is replaced by a script that exits right away.
+    """
+    build_dir = fixtures.path("build")
+    config = fixtures.path("bootstrap.toml")
+    with open(config, "w") as f:
+        f.write(fixtures.config_toml())
+    args = bootstrap.parse_args(
+        ["x.py", "--config", config, "--build-dir", build_dir, "check"]
+    )
+
+    build = bootstrap.RustBuild(args=args)
+    bin_root = build.bin_root()
+    os.makedirs(os.path.join(bin_root, "bin"))
+    for program in ["rustc", "cargo"]:
+        with open(os.path.join(bin_root, "bin", program + bootstrap.EXE_SUFFIX), "w"):
+            pass
+    with open(build.rustc_stamp(), "w") as f:
+        f.write(build.stage0_compiler.date)
+    binary = build.bootstrap_binary()
+    os.makedirs(os.path.dirname(binary))
+    with open(binary, "w") as f:
+        f.write("#!/bin/sh\nexit 0\n")
+    os.chmod(binary, 0o755)
+
+    # Let bootstrap record the fingerprint of the bootstrap "build" once.
+    command = {"args": [], "env": {}}
+    with patch.object(bootstrap.RustBuild, "build_bootstrap", return_value=command):
+        with patch("bootstrap.eprint"), patch("sys.argv", ["x.py", "check"]):
+            bootstrap.bootstrap(args)
+
+    x_py = os.path.join(bootstrap_dir, "..", "..", "x.py")
+    cmd = [sys.executable, x_py, "--config", config, "--build-dir", build_dir, "check"]
+
+    def run():
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+    return None, run, 1
+
+
+def run_benchmarks(fixtures, names, repeat):
+    results = {}
+    for func in BENCHMARKS:
+        name = func.__name__
+        if names and not any(n in name for n in names):
+            continue
+        with patch("bootstrap.eprint"):
+            setup, run, number = func(fixtures)
+            runs = []
+            for _ in range(repeat):
+                if setup is not None:
+                    setup()
+                start = perf_counter()
+                for _ in range(number):
+                    run()
+                runs.append((perf_counter() - start) / number)
+        results[name] = {
+            "description": (func.__doc__ or "").strip().split("\n")[0],
+            "min": min(runs),
+            "median": median(runs),
+            "runs": runs,
+        }
+        print("{:<24} {:>12}".format(name, format_seconds(min(runs))), flush=True)
+    return results
+
+
+def format_seconds(seconds):
+    """Format a duration for the results table
+
+    >>> format_seconds(0.0000123)
+    '12.3us'
+    >>> format_seconds(1.5)
+    '1.500s'
+    """
+    if seconds < 1e-3:
+        return "{:.1f}us".format(seconds * 1e6)
+    if seconds < 1:
+        return "{:.2f}ms".format(seconds * 1e3)
+    return "{:.3f}s".format(seconds)
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=bootstrap_dir,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def compare(results, baseline):
+    """Print how the minimum of each benchmark changed against `baseline`"""
+    for name, result in sorted(results.items()):
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        print(
+            "{:<24} {:>12} -> {:>12} ({:+.1f}%)".format(
+                name,
+                format_seconds(old["min"]),
+                format_seconds(result["min"]),
+                100 * (result["min"] - old["min"]) / old["min"],
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the hot paths of bootstrap.py")
+    parser.add_argument("names", nargs="*", help="only run benchmarks matching these")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this")
+    parser.add_argument("--baseline", help="compare against results from --output")
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "--quick", action="store_true", help="use smaller fixtures, for a smoke test"
+    )
+    args = parser.parse_args()
+
+    container = tempfile.mkdtemp()
+    fixtures = Fixtures(container, args.quick)
+    try:
+        results = run_benchmarks(fixtures, args.names, args.repeat)
+    finally:
+        fixtures.close()
+        rmtree(container)
+
+    report = {
+        "time": time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": bootstrap.get_cpus(),
+        "quick": args.quick,
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
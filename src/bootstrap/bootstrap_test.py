@@ -3,14 +3,23 @@
 Run these with `x test bootstrap`, or `python -m unittest src/bootstrap/bootstrap_test.py`."""
 
 from __future__ import absolute_import, division, print_function
+import contextlib
+import io
+import json
+import marshal
 import os
+import subprocess
 import unittest
 from unittest.mock import patch
+import tarfile
 import tempfile
+import threading
 import hashlib
 import sys
 
-from shutil import rmtree
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from shutil import rmtree, which
 
 # Allow running this from the top-level directory.
 bootstrap_dir = os.path.dirname(os.path.abspath(__file__))
@@ -71,6 +80,716 @@ class VerifyTestCase(unittest.TestCase):
         """Should verify that the file is invalid"""
         self.assertFalse(bootstrap.verify(self.bad_src, self.expected, False))
 
+    def test_cached_verification(self):
+        """A verified file is not hashed again until it changes"""
+        self.assertTrue(bootstrap.verify(self.src, self.expected, False))
+        self.assertTrue(bootstrap.is_verified(self.src, self.expected))
+        with patch("hashlib.sha256") as sha256:
+            self.assertTrue(bootstrap.verify(self.src, self.expected, False))
+            sha256.assert_not_called()
+
+        with open(self.src, "a") as src:
+            src.write("!")
+        self.assertFalse(bootstrap.is_verified(self.src, self.expected))
+        self.assertFalse(bootstrap.verify(self.src, self.expected, False))
+
+
+def make_tarball(path, mode="w:gz"):
+    """Create a tarball laid out like the rustc component, return its sha256"""
+    with tarfile.open(path, mode) as tar:
+        for name, content in [
+            ("rustc-beta-host/install.sh", b"#!/bin/sh"),
+            ("rustc-beta-host/rustc/bin/rustc", b"rustc"),
+            ("rustc-beta-host/rustc/lib/librustc_driver.so", b"driver"),
+            ("rustc-beta-host/rust-docs/share/index.html", b"docs"),
+        ]:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    with open(path, "rb") as tarball:
+        return hashlib.sha256(tarball.read()).hexdigest()
+
+
+class UnpackTestCase(unittest.TestCase):
+    """Test Case for unpack"""
+
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        self.tarball = os.path.join(self.container, "rustc-beta-host.tar.gz")
+        self.dst = os.path.join(self.container, "stage0")
+        os.mkdir(self.dst)
+        self.checksum = make_tarball(self.tarball)
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    def test_unpack_matching_members(self):
+        """Only the members of the component are extracted, without prefix"""
+        bootstrap.unpack(
+            self.tarball, ".tar.gz", self.dst, match="rustc", checksum=self.checksum
+        )
+        self.assertEqual(sorted(os.listdir(self.dst)), ["bin", "lib"])
+        with open(os.path.join(self.dst, "bin", "rustc"), "rb") as rustc:
+            self.assertEqual(rustc.read(), b"rustc")
+        self.assertTrue(os.path.exists(self.tarball))
+
+    def test_unpack_invalid_checksum(self):
+        """Nothing is extracted and the tarball is removed on a bad checksum"""
+        with self.assertRaises(RuntimeError):
+            bootstrap.unpack(
+                self.tarball, ".tar.gz", self.dst, match="rustc", checksum="0" * 64
+            )
+        self.assertEqual(os.listdir(self.dst), [])
+        self.assertFalse(os.path.exists(self.tarball))
+
+    def test_unpack_outside_dst(self):
+        """Members that would be written outside of dst are refused"""
+        victim = os.path.join(self.container, "victim")
+        with open(victim, "w") as f:
+            f.write("important")
+
+        def member(name, type=tarfile.REGTYPE, linkname=""):
+            info = tarfile.TarInfo("rustc-beta-host/rustc/" + name)
+            info.type = type
+            info.linkname = linkname
+            return info
+
+        for members in [
+            [member("../../victim")],
+            [member("link", tarfile.SYMTYPE, "../../victim")],
+            [member("link", tarfile.SYMTYPE, victim)],
+            [
+                member("dir", tarfile.SYMTYPE, "."),
+                member("dir/up", tarfile.SYMTYPE, ".."),
+            ],
+            [member("dir", tarfile.SYMTYPE, "."), member("dir/victim")],
+            [member("hard", tarfile.LNKTYPE, "rustc-beta-host/rustc/../../victim")],
+        ]:
+            with tarfile.open(self.tarball, "w:gz") as tar:
+                for info in members:
+                    tar.addfile(info, io.BytesIO())
+            checksum = bootstrap.sha256_file(self.tarball)
+            # With the right checksum and with a wrong one.
+            for expected in [checksum, "0" * 64]:
+                with self.assertRaises(RuntimeError):
+                    bootstrap.unpack(
+                        self.tarball,
+                        ".tar.gz",
+                        self.dst,
+                        match="rustc",
+                        checksum=expected,
+                    )
+                with open(victim) as f:
+                    self.assertEqual(f.read(), "important")
+                self.assertLessEqual(
+                    set(os.listdir(self.container)),
+                    {"rustc-beta-host.tar.gz", "stage0", "victim"},
+                )
+            rmtree(self.dst)
+            os.mkdir(self.dst)
+
+    @unittest.skipUnless(which("zstd"), "needs zstd to create the tarball")
+    def test_unpack_zstd(self):
+        tar = os.path.join(self.container, "rustc-beta-host.tar")
+        make_tarball(tar, "w")
+        subprocess.check_call(["zstd", "-q", "--rm", tar])
+        tarball = tar + ".zst"
+        checksum = bootstrap.sha256_file(tarball)
+
+        def unpack():
+            bootstrap.unpack(
+                tarball, ".tar.zst", self.dst, match="rustc", checksum=checksum
+            )
+            with open(os.path.join(self.dst, "bin", "rustc"), "rb") as rustc:
+                self.assertEqual(rustc.read(), b"rustc")
+            rmtree(self.dst)
+            os.unlink(bootstrap.verified_stamp(tarball))
+
+        # In-process if a zstd module is available, then with the zstd binary.
+        unpack()
+        with patch("bootstrap.ZstdFile", None), patch("bootstrap.zstandard", None):
+            unpack()
+
+
+class Stage0StoreTestCase(unittest.TestCase):
+    """Test that extracted components are shared between build directories"""
+
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.container, "cache", "stage0-store")
+        self.tarball = os.path.join(self.container, "rustc-beta-host.tar.gz")
+        self.checksum = make_tarball(self.tarball)
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    def install(self, build_dir):
+        download_info = bootstrap.DownloadInfo(
+            base_download_url="https://example.com",
+            download_path="dist/rustc-beta-host.tar.gz",
+            bin_root=os.path.join(self.container, build_dir, "stage0"),
+            tarball_path=self.tarball,
+            tarball_suffix=".tar.gz",
+            stage0_data={"dist/rustc-beta-host.tar.gz": self.checksum},
+            pattern="rustc",
+            verbose=False,
+            store_dir=self.store_dir,
+        )
+        bootstrap.unpack_component(download_info)
+        self.assertFalse(download_info.needs_download())
+        return os.path.join(download_info.bin_root, "bin", "rustc")
+
+    def test_shared_between_builds(self):
+        first = self.install("build1")
+        # The second build doesn't need the tarball anymore.
+        os.unlink(self.tarball)
+        second = self.install("build2")
+        with open(second, "rb") as rustc:
+            self.assertEqual(rustc.read(), b"rustc")
+        self.assertTrue(os.path.samefile(first, second))
+
+    def test_link_overlapping_trees(self):
+        """Components sharing directories can be linked at the same time"""
+        srcs = []
+        for name in ["rustc", "rust-std"]:
+            src = os.path.join(self.container, name)
+            lib = os.path.join(src, "lib", "rustlib", "host", "lib")
+            os.makedirs(lib)
+            with open(os.path.join(lib, name), "w") as f:
+                f.write(name)
+            srcs.append(src)
+        errors = []
+
+        def link(src, dst, barrier):
+            barrier.wait()
+            try:
+                bootstrap.link_tree(src, dst)
+            except OSError as e:
+                errors.append(e)
+
+        for i in range(50):
+            dst = os.path.join(self.container, "stage0-{}".format(i))
+            barrier = threading.Barrier(len(srcs))
+            threads = [
+                threading.Thread(target=link, args=(src, dst, barrier)) for src in srcs
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            lib = os.path.join(dst, "lib", "rustlib", "host", "lib")
+            self.assertEqual(sorted(os.listdir(lib)), ["rust-std", "rustc"])
+
+    def test_garbage_collection(self):
+        self.install("build1")
+        entry = os.path.join(self.store_dir, self.checksum)
+        os.utime(entry, (0, 0))
+        # Still linked from build1.
+        bootstrap.collect_store_garbage(self.store_dir, keep=[])
+        self.assertTrue(os.path.isdir(entry))
+
+        rmtree(os.path.join(self.container, "build1"))
+        bootstrap.collect_store_garbage(self.store_dir, keep=[self.checksum])
+        self.assertTrue(os.path.isdir(entry))
+        bootstrap.collect_store_garbage(self.store_dir, keep=[])
+        self.assertFalse(os.path.exists(entry))
+
+    def test_replace_component(self):
+        bin_root = os.path.dirname(os.path.dirname(self.install("build1")))
+        files = bootstrap.tree_files(os.path.join(self.store_dir, self.checksum))
+        self.assertEqual(
+            files,
+            [os.path.join("bin", "rustc"), os.path.join("lib", "librustc_driver.so")],
+        )
+        installed = {"checksum": self.checksum, "files": files}
+        self.assertTrue(
+            bootstrap.component_installed(bin_root, installed, self.checksum)
+        )
+        self.assertFalse(bootstrap.component_installed(bin_root, installed, "bumped"))
+
+        with open(os.path.join(bin_root, "unrelated"), "w"):
+            pass
+        bootstrap.remove_files(bin_root, files)
+        self.assertEqual(os.listdir(bin_root), ["unrelated"])
+        self.assertFalse(
+            bootstrap.component_installed(bin_root, installed, self.checksum)
+        )
+
+    def test_unshare(self):
+        rustc = self.install("build1")
+        bootstrap.unshare(rustc)
+        with open(rustc, "wb") as f:
+            f.write(b"patched")
+        with open(os.path.join(self.store_dir, self.checksum, "bin", "rustc")) as f:
+            self.assertEqual(f.read(), "rustc")
+
+
+@unittest.skipIf(sys.platform == "win32", "patchelf is only used on NixOS")
+class ReadStage0Manifest(unittest.TestCase):
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        self.build = bootstrap.RustBuild()
+        self.build.build_dir = self.container
+        os.makedirs(self.build.bin_root())
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    def test_corrupt(self):
+        """A damaged manifest means that everything is installed again"""
+        manifest = {"rustc": {"checksum": "0" * 64, "files": ["bin/rustc"]}}
+        with open(self.build.stage0_manifest(), "w") as f:
+            json.dump(manifest, f)
+        self.assertEqual(self.build.read_stage0_manifest(), manifest)
+        for contents in ['{"rustc": {"checksum', "", "[]"]:
+            with open(self.build.stage0_manifest(), "w") as f:
+                f.write(contents)
+            self.assertEqual(self.build.read_stage0_manifest(), {})
+
+
+class FixBinsAndDylibsTestCase(unittest.TestCase):
+    """Test that patched stage0 files are reused between build directories"""
+
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.container, "cache", "stage0-patched")
+        nix_deps_dir = os.path.join(self.container, ".nix-deps")
+        os.makedirs(os.path.join(nix_deps_dir, "bin"))
+        os.makedirs(os.path.join(nix_deps_dir, "nix-support"))
+        with open(
+            os.path.join(nix_deps_dir, "nix-support", "dynamic-linker"), "w"
+        ) as f:
+            f.write("/nix/store/ld.so\n")
+        # Appends to the patched file and logs it.
+        self.log = os.path.join(self.container, "patchelf.log")
+        patchelf = os.path.join(nix_deps_dir, "bin", "patchelf")
+        with open(patchelf, "w") as f:
+            f.write(
+                '#!/bin/sh\nfor f; do :; done\n[ -f "$f" ] || exit 1\n'
+                'echo "$f" >> {}\nprintf " patched" >> "$f"\n'.format(self.log)
+            )
+        os.chmod(patchelf, 0o755)
+
+        self.build = bootstrap.RustBuild()
+        self.build.build = "host"
+        self.build.nix_deps_dir = nix_deps_dir
+        self.build._should_fix_bins_and_dylibs = True
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    def install(self, build_dir):
+        bin_root = os.path.join(self.container, build_dir, "stage0")
+        os.makedirs(os.path.join(bin_root, "bin"))
+        os.makedirs(os.path.join(bin_root, "lib"))
+        with open(os.path.join(bin_root, "bin", "rustc"), "wb") as f:
+            f.write(b"rustc")
+        with open(os.path.join(bin_root, "lib", "librustc_driver.so"), "wb") as f:
+            f.write(b"\x7fELF")
+        with patch("bootstrap.eprint"):
+            self.build.fix_bins_and_dylibs(bin_root, self.cache_dir)
+        return bin_root
+
+    def patched(self):
+        with open(self.log) as log:
+            return len(log.readlines())
+
+    def test_reuse_patched(self):
+        first = self.install("build1")
+        self.assertEqual(self.patched(), 2)
+        second = self.install("build2")
+        self.assertEqual(self.patched(), 2)
+        for name in ["bin/rustc", "lib/librustc_driver.so"]:
+            with open(os.path.join(second, name), "rb") as f:
+                self.assertTrue(f.read().endswith(b" patched"))
+            self.assertTrue(
+                os.path.samefile(os.path.join(first, name), os.path.join(second, name))
+            )
+
+
+class StartupTraceTestCase(unittest.TestCase):
+    """Test the Chrome trace written for BOOTSTRAP_STARTUP_TRACE"""
+
+    def test_write(self):
+        trace = bootstrap.StartupTrace()
+        with trace.phase("download", url="dist/rustc.tar.xz"):
+            trace.count("bytes downloaded", 100)
+            trace.count("bytes downloaded", 20)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            path = f.name
+        try:
+            trace.write(path)
+            with open(path) as f:
+                data = json.load(f)
+        finally:
+            os.unlink(path)
+        self.assertEqual(data["otherData"], {"bytes downloaded": 120})
+        phase, counters = data["traceEvents"]
+        self.assertEqual(phase["name"], "download")
+        self.assertEqual(phase["ph"], "X")
+        self.assertEqual(phase["args"], {"url": "dist/rustc.tar.xz"})
+        self.assertGreaterEqual(phase["dur"], 0)
+        self.assertEqual(counters["ph"], "C")
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serve files like a dist server, honoring `Range: bytes=a-b` requests"""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        self.server.connections += 1
+        SimpleHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        parts = self.path.partition("?")[0].split("/")
+        path = os.path.join(self.server.directory, *[p for p in parts if p])
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            content = f.read()
+
+        start, end = 0, len(content)
+        byte_range = self.headers.get("Range")
+        if byte_range is not None and self.server.ranges:
+            first, last = byte_range[len("bytes=") :].split("-")
+            start = int(first)
+            if last:
+                end = min(end, int(last) + 1)
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes {}-{}/{}".format(start, end - 1, len(content))
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        if self.server.short_reads:
+            # Drop the connection halfway through the response.
+            self.server.short_reads -= 1
+            end = start + (end - start) // 2
+            self.close_connection = True
+        self.wfile.write(content[start:end])
+
+    def log_message(self, *args):
+        pass
+
+
+class RangeServer(ThreadingMixIn, HTTPServer):
+    """A local dist server, see `serve`"""
+
+    daemon_threads = True
+
+
+def serve(test, directory):
+    """Serve `directory` with `RangeRequestHandler` until `test` is done
+
+    The server counts its `connections`, records the `requests` it gets, and
+    can be told to ignore `ranges` or to cut the next `short_reads` responses
+    short. Returns the server and its base URL.
+    """
+    server = RangeServer(("127.0.0.1", 0), RangeRequestHandler)
+    server.directory = directory
+    server.connections = 0
+    server.requests = []
+    server.ranges = True
+    server.short_reads = 0
+    threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return server, "http://127.0.0.1:{}".format(server.server_port)
+
+
+class HttpDownloaderTestCase(unittest.TestCase):
+    """Test Case for the in-process downloader, against a local server"""
+
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        self.content = os.urandom(10000)
+        with open(os.path.join(self.container, "rustc.tar.xz"), "wb") as f:
+            f.write(self.content)
+        self.dst = os.path.join(self.container, "download")
+        self.server, base = serve(self, self.container)
+        self.url = base + "/rustc.tar.xz"
+        self.downloader = bootstrap.HttpDownloader()
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    def downloaded(self):
+        with open(self.dst, "rb") as f:
+            return f.read()
+
+    def test_download_reuses_connection(self):
+        self.downloader.download(self.dst, self.url)
+        self.assertEqual(self.downloaded(), self.content)
+        os.unlink(self.dst)
+        self.downloader.download(self.dst, self.url)
+        self.assertEqual(self.downloaded(), self.content)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_segmented_download(self):
+        self.downloader.SEGMENT_SIZE = 1000
+        self.downloader.download(self.dst, self.url)
+        self.assertEqual(self.downloaded(), self.content)
+        # The first segment, then the rest split across `MAX_SEGMENTS` requests.
+        self.assertEqual(len(self.server.requests), 1 + 4)
+
+    def test_resume(self):
+        with open(self.dst, "wb") as f:
+            f.write(self.content[:3000])
+        self.downloader.download(self.dst, self.url)
+        self.assertEqual(self.downloaded(), self.content)
+        self.assertTrue(self.server.requests[0][1].startswith("bytes=3000-"))
+
+    def test_resume_without_range_support(self):
+        self.server.ranges = False
+        with open(self.dst, "wb") as f:
+            f.write(b"garbage")
+        self.downloader.download(self.dst, self.url)
+        self.assertEqual(self.downloaded(), self.content)
+
+    def test_short_read(self):
+        """A response cut short is detected and resumed, for every segment"""
+        self.downloader.SEGMENT_SIZE = 1000
+        for ranges in [True, False]:
+            self.server.ranges = ranges
+            self.server.short_reads = 1
+            with self.assertRaises(RuntimeError):
+                self.downloader.download(self.dst, self.url)
+            # Only what was received in one piece is kept.
+            self.assertEqual(self.downloaded(), self.content[: len(self.downloaded())])
+            self.downloader.download(self.dst, self.url)
+            self.assertEqual(self.downloaded(), self.content)
+            os.unlink(self.dst)
+
+    def test_not_found(self):
+        with self.assertRaises(RuntimeError):
+            self.downloader.download(self.dst, self.url + ".missing")
+
+    def get(self):
+        base = self.url.rpartition("/")[0]
+        checksums = {"rustc.tar.xz": hashlib.sha256(self.content).hexdigest()}
+        with patch.object(bootstrap, "http_downloader", self.downloader):
+            bootstrap.get(base, "rustc.tar.xz", self.dst, checksums)
+
+    def test_get_resumes_partial_download(self):
+        with open(self.dst + ".part", "wb") as f:
+            f.write(self.content[:3000])
+        self.get()
+        self.assertEqual(self.downloaded(), self.content)
+        self.assertTrue(self.server.requests[0][1].startswith("bytes=3000-"))
+        self.assertFalse(os.path.exists(self.dst + ".part"))
+        self.assertFalse(os.path.exists(self.dst + ".part.lock"))
+
+    @patch("bootstrap.eprint")
+    def test_get_discards_bad_partial_download(self, eprint):
+        with open(self.dst + ".part", "wb") as f:
+            f.write(b"garbage")
+        self.get()
+        self.assertEqual(self.downloaded(), self.content)
+        self.assertTrue(self.server.requests[0][1].startswith("bytes=7-"))
+        self.assertTrue(self.server.requests[-1][1].startswith("bytes=0-"))
+
+    @patch("bootstrap.eprint")
+    def test_download_component_discards_bad_partial_download(self, eprint):
+        """Resumed downloads are verified even if unpack is left to do it"""
+        with open(self.dst + ".part", "wb") as f:
+            f.write(b"garbage")
+        info = bootstrap.DownloadInfo(
+            base_download_url=self.url.rpartition("/")[0],
+            download_path="rustc.tar.xz",
+            bin_root=self.container,
+            tarball_path=self.dst,
+            tarball_suffix=".tar.xz",
+            stage0_data={"rustc.tar.xz": hashlib.sha256(self.content).hexdigest()},
+            pattern="rustc",
+            verbose=False,
+        )
+        with patch.object(bootstrap, "http_downloader", self.downloader):
+            bootstrap.download_component(info)
+        self.assertEqual(self.downloaded(), self.content)
+        self.assertTrue(self.server.requests[-1][1].startswith("bytes=0-"))
+
+    def test_get_while_locked(self):
+        """A download in progress elsewhere is left alone"""
+        with open(self.dst + ".part", "wb") as f:
+            f.write(b"someone else's")
+        with bootstrap.try_lock(self.dst + ".part.lock") as locked:
+            self.assertTrue(locked)
+            self.get()
+        self.assertEqual(self.downloaded(), self.content)
+        with open(self.dst + ".part", "rb") as f:
+            self.assertEqual(f.read(), b"someone else's")
+        self.assertEqual(
+            sorted(os.listdir(self.container)),
+            [
+                "download",
+                "download.part",
+                "download.part.lock",
+                "download.sha256",
+                "rustc.tar.xz",
+            ],
+        )
+
+    @patch("bootstrap.sleep")
+    @patch("bootstrap.eprint")
+    def test_download_backoff(self, eprint, sleep):
+        failures = [RuntimeError("timeout")] * 3
+
+        def flaky(path, *args):
+            if failures:
+                with open(path, "ab") as f:
+                    f.write(b"x")
+                raise failures.pop()
+
+        with patch("bootstrap._download", side_effect=flaky):
+            bootstrap.download(self.dst, self.url, True, False)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [1, 2, 4])
+        # Every attempt picked up where the previous one stopped.
+        self.assertEqual(self.downloaded(), b"xxx")
+
+
+class PrefetchStage0TestCase(unittest.TestCase):
+    """Test mirroring stage0 tarballs and bootstrapping from the mirror"""
+
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        server_dir = os.path.join(self.container, "server")
+        os.makedirs(os.path.join(server_dir, "dist", "2025-01-01"))
+        self.stage0_data = {}
+        for name in ["rustc-beta-host.tar.xz", "cargo-beta-host.tar.xz"]:
+            artifact = "dist/2025-01-01/" + name
+            with open(os.path.join(server_dir, artifact), "wb") as f:
+                f.write(name.encode("utf-8"))
+            self.stage0_data[artifact] = hashlib.sha256(
+                name.encode("utf-8")
+            ).hexdigest()
+        self.server, self.url = serve(self, server_dir)
+        self.mirror = os.path.join(self.container, "mirror")
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    @patch("bootstrap.eprint")
+    def test_prefetch(self, eprint):
+        artifacts = bootstrap.stage0_artifacts(self.stage0_data, ["host"], [".tar.xz"])
+        self.assertEqual(len(artifacts), 2)
+        failed = bootstrap.prefetch_stage0(
+            self.stage0_data, self.url, self.mirror, artifacts, jobs=2
+        )
+        self.assertEqual(failed, [])
+        self.assertEqual(len(self.server.requests), 2)
+        mirrored = os.listdir(os.path.join(self.mirror, "dist", "2025-01-01"))
+        self.assertEqual([name for name in mirrored if name.endswith(".lock")], [])
+
+        # Refreshing the mirror doesn't fetch anything again.
+        bootstrap.prefetch_stage0(
+            self.stage0_data, self.url, self.mirror, artifacts, jobs=2
+        )
+        self.assertEqual(len(self.server.requests), 2)
+
+        # A build can then download from the mirror.
+        dst = os.path.join(self.container, "rustc-beta-host.tar.xz")
+        bootstrap.get(
+            "file://" + self.mirror.replace(os.sep, "/"),
+            artifacts[1],
+            dst,
+            self.stage0_data,
+        )
+        with open(dst, "rb") as f:
+            self.assertEqual(f.read(), b"rustc-beta-host.tar.xz")
+
+    @patch("bootstrap.sleep")
+    @patch("bootstrap.eprint")
+    def test_mirror_missing(self, eprint, sleep):
+        """A tarball missing from the mirror is retried, then reported"""
+        os.makedirs(self.mirror)
+        dst = os.path.join(self.container, "rustc-beta-host.tar.xz")
+        with self.assertRaises(SystemExit):
+            bootstrap.get(
+                "file://" + self.mirror.replace(os.sep, "/"),
+                "dist/2025-01-01/rustc-beta-host.tar.xz",
+                dst,
+                self.stage0_data,
+            )
+        self.assertEqual(sleep.call_count, 4)
+        self.assertTrue(eprint.call_args[0][0].startswith("ERROR: failed to copy"))
+        self.assertFalse(os.path.exists(dst))
+
+    @patch("bootstrap.eprint")
+    def test_prefetch_missing(self, eprint):
+        missing = "dist/2025-01-01/rust-std-beta-host.tar.xz"
+        self.stage0_data[missing] = "0" * 64
+        with patch.object(bootstrap.http_downloader, "failed", False):
+            with patch("bootstrap.run", side_effect=RuntimeError("curl failed")):
+                with patch("bootstrap.sleep"):
+                    failed = bootstrap.prefetch_stage0(
+                        self.stage0_data, self.url, self.mirror, [missing], jobs=2
+                    )
+        self.assertEqual(failed, [missing])
+        self.assertFalse(os.path.exists(os.path.join(self.mirror, missing)))
+
+
+class DefaultBuildTriple(unittest.TestCase):
+    """Test the detection of the host triple"""
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "needs Linux")
+    @patch("subprocess.check_output", side_effect=AssertionError("spawned"))
+    def test_linux_without_subprocess(self, check_output):
+        triple = bootstrap.default_build_triple.__wrapped__(False)
+        self.assertRegex(triple, r"-linux-")
+        check_output.assert_not_called()
+
+    def test_cached(self):
+        triple = bootstrap.default_build_triple(False)
+        with patch("subprocess.check_output", side_effect=AssertionError("spawned")):
+            self.assertEqual(bootstrap.default_build_triple(False), triple)
+
+
+class ParseStage0File(unittest.TestCase):
+    """Test that the parsed stage0 file is cached until it changes"""
+
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        self.path = os.path.join(self.container, "stage0")
+        self.cache = os.path.join(self.container, "stage0.marshal")
+        with open(self.path, "w") as f:
+            f.write("# comment\ncompiler_date=2025-01-01\ndist/a.tar.xz=abc\n")
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    def test_cached(self):
+        expected = {"compiler_date": "2025-01-01", "dist/a.tar.xz": "abc"}
+        self.assertEqual(bootstrap.parse_stage0_file(self.path, self.cache), expected)
+        self.assertTrue(os.path.exists(self.cache))
+        with patch("bootstrap.open", side_effect=[open(self.cache, "rb")]):
+            self.assertEqual(
+                bootstrap.parse_stage0_file(self.path, self.cache), expected
+            )
+
+    def test_changed(self):
+        bootstrap.parse_stage0_file(self.path, self.cache)
+        with open(self.path, "a") as f:
+            f.write("dist/b.tar.xz=def\n")
+        result = bootstrap.parse_stage0_file(self.path, self.cache)
+        self.assertEqual(result["dist/b.tar.xz"], "def")
+
+    def test_corrupt_cache(self):
+        with open(self.cache, "wb") as f:
+            f.write(b"garbage")
+        result = bootstrap.parse_stage0_file(self.path, self.cache)
+        self.assertEqual(result["dist/a.tar.xz"], "abc")
+
 
 class ProgramOutOfDate(unittest.TestCase):
     """Test if a program is out of date"""
@@ -108,6 +827,138 @@ class ProgramOutOfDate(unittest.TestCase):
         )
 
 
+class BootstrapFingerprint(unittest.TestCase):
+    """Test that cargo is only skipped when nothing changed"""
+
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        self.build = bootstrap.RustBuild()
+        self.build.build_dir = self.container
+        os.makedirs(os.path.dirname(self.build.bootstrap_binary()))
+        with open(self.build.bootstrap_binary(), "w") as binary:
+            binary.write("bootstrap")
+        self.env = {"RUSTFLAGS": "-Copt-level=1", "HOME": "/home/user"}
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    def test_unchanged(self):
+        self.build.record_bootstrap_fingerprint(
+            self.build.bootstrap_fingerprint(self.env)
+        )
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.assertTrue(self.build.bootstrap_up_to_date(fingerprint))
+        # Unrelated environment variables don't matter.
+        self.env["HOME"] = "/home/other"
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.assertTrue(self.build.bootstrap_up_to_date(fingerprint))
+
+    def test_changed(self):
+        self.build.record_bootstrap_fingerprint(
+            self.build.bootstrap_fingerprint(self.env)
+        )
+        self.env["RUSTFLAGS"] = ""
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.assertFalse(self.build.bootstrap_up_to_date(fingerprint))
+
+    def test_build_triple_and_cargo_config(self):
+        self.build.rust_root = self.container
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.build.record_bootstrap_fingerprint(fingerprint)
+        self.build.build = "riscv64gc-unknown-linux-gnu"
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.assertFalse(self.build.bootstrap_up_to_date(fingerprint))
+        self.build.record_bootstrap_fingerprint(fingerprint)
+        os.mkdir(os.path.join(self.container, ".cargo"))
+        with open(os.path.join(self.container, ".cargo", "config.toml"), "w") as f:
+            f.write("[build]\nrustflags = ['-Ctarget-cpu=native']\n")
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.assertFalse(self.build.bootstrap_up_to_date(fingerprint))
+
+    def test_dep_info_and_rust_root(self):
+        self.build.rust_root = self.container
+        included = os.path.join(self.container, "src", "etc", "rust analyzer.json")
+        os.makedirs(os.path.dirname(included))
+        with open(included, "w") as f:
+            f.write("{}")
+        with open(self.build.bootstrap_binary() + ".d", "w") as f:
+            f.write(
+                "{}: {}\n".format(
+                    self.build.bootstrap_binary(), included.replace(" ", "\\ ")
+                )
+            )
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.assertIn("etc/rust analyzer.json", fingerprint["sources"])
+        self.build.record_bootstrap_fingerprint(fingerprint)
+        with open(included, "a") as f:
+            f.write("\n")
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.assertFalse(self.build.bootstrap_up_to_date(fingerprint))
+        self.build.record_bootstrap_fingerprint(fingerprint)
+
+        # The binary remembers where the sources are.
+        self.build.rust_root = os.path.join(self.container, "moved")
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.assertFalse(self.build.bootstrap_up_to_date(fingerprint))
+
+    def test_binary_replaced(self):
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.build.record_bootstrap_fingerprint(fingerprint)
+        with open(self.build.bootstrap_binary(), "a") as binary:
+            binary.write("!")
+        self.assertFalse(self.build.bootstrap_up_to_date(fingerprint))
+
+    def test_clean(self):
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.build.record_bootstrap_fingerprint(fingerprint)
+        self.build.clean = True
+        self.assertFalse(self.build.bootstrap_up_to_date(fingerprint))
+
+    def test_changes_explained(self):
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        command = {"args": ["cargo", "build"], "env": {"RUSTFLAGS": "-Copt-level=1"}}
+        self.build.record_bootstrap_fingerprint(fingerprint, command)
+        recorded = self.build.read_bootstrap_fingerprint()
+        self.assertEqual(recorded["command"], command)
+        binary = bootstrap.file_identity(self.build.bootstrap_binary())
+        self.assertEqual(
+            bootstrap.fingerprint_changes(recorded, fingerprint, binary, command), []
+        )
+        self.env["RUSTFLAGS"] = ""
+        fingerprint = self.build.bootstrap_fingerprint(self.env)
+        self.assertEqual(
+            bootstrap.fingerprint_changes(recorded, fingerprint, binary, command),
+            ["env RUSTFLAGS: -Copt-level=1 -> "],
+        )
+
+
+class CheckVendoredStatus(unittest.TestCase):
+    """Test that git is only consulted when vendoring is misconfigured"""
+
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        self.build = bootstrap.RustBuild()
+        self.build.rust_root = self.container
+        self.build.use_vendored_sources = True
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    @patch.object(bootstrap.RustBuild, "get_latest_commit")
+    def test_vendored(self, get_latest_commit):
+        os.mkdir(os.path.join(self.container, "vendor"))
+        os.mkdir(os.path.join(self.container, ".cargo"))
+        self.build.check_vendored_status()
+        get_latest_commit.assert_not_called()
+
+    @patch("bootstrap.eprint")
+    @patch.object(bootstrap.RustBuild, "get_latest_commit", return_value="abc")
+    def test_missing_vendor_dir(self, get_latest_commit, eprint):
+        with self.assertRaisesRegex(Exception, "not found"):
+            self.build.check_vendored_status()
+        get_latest_commit.assert_called_once()
+
+
 class ParseArgsInConfigure(unittest.TestCase):
     """Test if `parse_args` function in `configure.py` works properly"""
 
@@ -154,6 +1005,12 @@ class ParseArgsInConfigure(unittest.TestCase):
         known_args = configure.parse_args(["--target", "x86_64-unknown-linux-gnu"])
         self.assertEqual(known_args["target"][0][1], "x86_64-unknown-linux-gnu")
 
+    @patch("configure.err")
+    def test_boolean_option_with_value(self, err):
+        # `--enable-*` and `--disable-*` don't take a value
+        configure.parse_args(["--enable-full-tools=yes"])
+        err.assert_called_with("Option '--enable-full-tools=yes' is not recognized")
+
 
 class GenerateAndParseConfig(unittest.TestCase):
     """Test that we can serialize and deserialize a bootstrap.toml file"""
@@ -173,6 +1030,35 @@ class GenerateAndParseConfig(unittest.TestCase):
             build.get_toml("cc", section="target.x86_64-unknown-linux-gnu"), "gcc"
         )
 
+    def test_set_multiple_targets(self):
+        build = serialize_and_parse(
+            [
+                "--target=x86_64-unknown-linux-gnu,aarch64-unknown-linux-gnu",
+                "--set",
+                "target.x86_64-unknown-linux-gnu.cc=gcc",
+                "--set",
+                "target.aarch64-unknown-linux-gnu.cc=clang",
+            ]
+        )
+        self.assertEqual(
+            build.get_toml("cc", section="target.x86_64-unknown-linux-gnu"), "gcc"
+        )
+        self.assertEqual(
+            build.get_toml("cc", section="target.aarch64-unknown-linux-gnu"), "clang"
+        )
+
+    def test_targets_share_template(self):
+        _, _, targets = configure.parse_args(
+            ["--target=a,b", "--set", "target.a.cc=gcc"]
+        )
+        self.assertIs(targets["a"].template, targets["b"].template)
+        self.assertEqual(targets["b"].changed, {0: "[target.b]"})
+        self.assertIn("cc = 'gcc'", list(targets["a"]))
+
+    def test_set_unknown_key(self):
+        with self.assertRaisesRegex(RuntimeError, "failed to find config line"):
+            serialize_and_parse(["--set", "rust.no-such-option=true"])
+
     def test_set_top_level(self):
         build = serialize_and_parse(["--set", "profile=compiler"])
         self.assertEqual(build.get_toml("profile"), "compiler")
@@ -189,6 +1075,96 @@ class GenerateAndParseConfig(unittest.TestCase):
         build = serialize_and_parse(["--enable-full-tools"])
         self.assertNotEqual(build.config_toml.find("codegen-backends = ['llvm']"), -1)
 
+    def test_profile_defaults_do_not_override(self):
+        build = serialize_and_parse(["--set", "rust.deny-warnings=false"])
+        self.assertEqual(build.get_toml("deny-warnings", "rust"), "false")
+        # Appended defaults repeat the section, but the first value still wins.
+        build.config_toml += "\n[rust]\ndeny-warnings = true\ndebug = true\n"
+        self.assertEqual(build.get_toml("deny-warnings", "rust"), "false")
+        self.assertEqual(build.get_toml("debug", "rust"), "true")
+
+
+class ConfigureTemplate(unittest.TestCase):
+    """Test that bootstrap.example.toml is parsed once and can be cached"""
+
+    def setUp(self):
+        self.container = tempfile.mkdtemp()
+        self.cache = os.path.join(self.container, "cache", "template.marshal")
+
+    def tearDown(self):
+        rmtree(self.container)
+
+    def test_cached(self):
+        configure.parsed_example_configs.clear()
+        parsed = configure.load_example_config(self.cache)
+        self.assertTrue(os.path.exists(self.cache))
+        # Parsed once per process...
+        with patch("configure.parse_example_lines") as parse:
+            self.assertIs(configure.load_example_config(), parsed)
+            # ... and then from the cache.
+            configure.parsed_example_configs.clear()
+            self.assertEqual(configure.load_example_config(self.cache), parsed)
+            parse.assert_not_called()
+
+    def test_stale_cache(self):
+        os.makedirs(os.path.dirname(self.cache))
+        with open(self.cache, "wb") as f:
+            f.write(marshal.dumps(("0" * 64, ([None], {None: []}, [], {}))))
+        configure.parsed_example_configs.clear()
+        section_order, _, _, _ = configure.load_example_config(self.cache)
+        self.assertIn("target", section_order)
+
+    @patch("configure.p")
+    def test_batch(self, p):
+        args = ["--set", "rust.channel=nightly", "--target=x86_64-unknown-linux-gnu"]
+        section_order, sections, targets = configure.parse_args(args)
+        expected = io.StringIO()
+        configure.write_config_toml(expected, section_order, targets, sections)
+
+        jobs = os.path.join(self.container, "jobs")
+        with open(jobs, "w") as f:
+            f.write("# A comment\n\n")
+            f.write("{} {}\n".format(os.path.join(self.container, "a"), " ".join(args)))
+            f.write("{} --set rust.no-such-option\n".format(self.container))
+        with patch("builtins.print"):
+            failed = configure.configure_batch(configure.read_batch_file(jobs))
+        self.assertEqual(failed, [self.container])
+        with open(os.path.join(self.container, "a", "bootstrap.toml")) as f:
+            self.assertEqual(f.read(), expected.getvalue())
+
+        # The same, from a process pool.
+        jobs = [(os.path.join(self.container, name), args) for name in "bc"]
+        self.assertEqual(configure.configure_batch(jobs, processes=2), [])
+        for name in "bc":
+            with open(os.path.join(self.container, name, "bootstrap.toml")) as f:
+                self.assertEqual(f.read(), expected.getvalue())
+
+    def test_batch_output(self):
+        """Jobs run in parallel print their output without interleaving"""
+        jobs = [
+            (os.path.join(self.container, name), ["--set", "rust.channel=" + name])
+            for name in ["a", "b", "c", "d"]
+        ]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(configure.configure_batch(jobs, processes=4), [])
+        blocks = output.getvalue().split("configure: configuring ")[1:]
+        self.assertEqual(len(blocks), len(jobs))
+        for (directory, args), block in zip(jobs, blocks):
+            self.assertTrue(block.startswith(directory + "\n"))
+            self.assertIn("configure: rust.channel         := " + args[1][-1], block)
+
+    def test_batch_manifests(self):
+        expected = [("a", ["--target=x,y", "--set", "rust.channel=beta"]), ("b", [])]
+        json_path = os.path.join(self.container, "jobs.json")
+        with open(json_path, "w") as f:
+            json.dump([{"directory": d, "args": args} for d, args in expected], f)
+        self.assertEqual(configure.read_batch_file(json_path), expected)
+        csv_path = os.path.join(self.container, "jobs.csv")
+        with open(csv_path, "w") as f:
+            f.write('# directory,args\na,"--target=x,y",--set,rust.channel=beta\nb\n')
+        self.assertEqual(configure.read_batch_file(csv_path), expected)
+
 
 class BuildBootstrap(unittest.TestCase):
     """Test that we generate the appropriate arguments when building bootstrap"""
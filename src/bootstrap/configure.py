@@ -3,6 +3,13 @@
 # ignore-tidy-linelength
 
 from __future__ import absolute_import, division, print_function
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import marshal
 import shlex
 import sys
 import os
@@ -24,14 +31,29 @@ class Option(object):
 
 
 options = []
+# `options` by name, and by the argument that selects them (without the
+# leading `--`) along with the value that implies, if any.
+options_by_name = {}
+options_by_arg = {}
+
+
+def add_option(option):
+    options.append(option)
+    # Like a search of `options` would, let the first option win.
+    options_by_name.setdefault(option.name, option)
+    if option.value:
+        options_by_arg.setdefault(option.name, (option, None))
+    else:
+        options_by_arg.setdefault("enable-" + option.name, (option, True))
+        options_by_arg.setdefault("disable-" + option.name, (option, False))
 
 
 def o(*args):
-    options.append(Option(*args, value=False))
+    add_option(Option(*args, value=False))
 
 
 def v(*args):
-    options.append(Option(*args, value=True))
+    add_option(Option(*args, value=True))
 
 
 o(
@@ -352,10 +374,8 @@ def err(msg):
 
 
 def is_value_list(key):
-    for option in options:
-        if option.name == key and option.desc.startswith("List of"):
-            return True
-    return False
+    option = options_by_name.get(key)
+    return option is not None and option.desc.startswith("List of")
 
 
 if "--help" in sys.argv or "-h" in sys.argv:
@@ -384,11 +404,15 @@ if "--help" in sys.argv or "-h" in sys.argv:
     sys.exit(0)
 
 VERBOSE = False
+# Whether to keep the parsed bootstrap.example.toml in the build directory.
+USE_TEMPLATE_CACHE = False
+# The parsed bootstrap.example.toml, by the sha256 of its content.
+parsed_example_configs = {}
 
 
 # Parse all command line arguments into one of these three lists, handling
 # boolean and value-based options separately
-def parse_args(args):
+def classify_args(args):
     unknown_args = []
     need_value_args = []
     known_args = {}
@@ -401,39 +425,33 @@ def parse_args(args):
             unknown_args.append(arg)
             continue
 
-        found = False
-        for option in options:
-            value = None
-            if option.value:
-                keyval = arg[2:].split("=", 1)
-                key = keyval[0]
-                if option.name != key:
-                    continue
+        key, eq, value = arg[2:].partition("=")
+        option, implied = options_by_arg.get(key, (None, None))
+        if option is None or (eq and not option.value):
+            unknown_args.append(arg)
+            continue
 
-                if len(keyval) > 1:
-                    value = keyval[1]
-                elif i < len(args):
-                    value = args[i]
-                    i += 1
-                else:
-                    need_value_args.append(arg)
-                    continue
+        if not option.value:
+            value = implied
+        elif not eq:
+            if i < len(args):
+                value = args[i]
+                i += 1
             else:
-                if arg[2:] == "enable-" + option.name:
-                    value = True
-                elif arg[2:] == "disable-" + option.name:
-                    value = False
-                else:
-                    continue
+                # This is reported as both unknown and missing its value.
+                need_value_args.append(arg)
+                unknown_args.append(arg)
+                continue
 
-            found = True
-            if option.name not in known_args:
-                known_args[option.name] = []
-            known_args[option.name].append((option, value))
-            break
+        if option.name not in known_args:
+            known_args[option.name] = []
+        known_args[option.name].append((option, value))
+
+    return known_args, unknown_args, need_value_args
 
-        if not found:
-            unknown_args.append(arg)
+
+def parse_args(args):
+    known_args, unknown_args, need_value_args = classify_args(args)
 
     # NOTE: here and a few other places, we use [-1] to apply the *last* value
     # passed.  But if option-checking is enabled, then the known_args loop will
@@ -580,16 +598,90 @@ def apply_args(known_args, option_checking, config):
 # Note that the `target` section is handled separately as we'll duplicate it
 # per configured target, so there's a bit of special handling for that here.
 def parse_example_config(known_args, config):
+    cache_path = None
+    if USE_TEMPLATE_CACHE:
+        build_dir = config.get("build", {}).get("build-dir") or "build"
+        cache_path = os.path.join(build_dir, "cache", "configure-template.marshal")
+    section_order, template, top_level_keys, indexes = load_example_config(cache_path)
+    # `configure_file` edits the lines, leave the template as it is.
+    section_order = section_order[:]
+    sections = {section: lines[:] for section, lines in template.items()}
+    targets = {}
+
+    # Fill out the `targets` array by giving all configured targets a copy of the
+    # `target` section we just loaded from the example config
+    configured_targets = [build(known_args)]
+    if "build" in config:
+        if "host" in config["build"]:
+            configured_targets += config["build"]["host"]
+        if "target" in config["build"]:
+            configured_targets += config["build"]["target"]
+    if "target" in config:
+        for target in config["target"]:
+            configured_targets.append(target)
+    for target in configured_targets:
+        targets[target] = TargetSection(sections["target"])
+        # For `.` to be valid TOML, it needs to be quoted. But `bootstrap.py` doesn't use a proper TOML parser and fails to parse the target.
+        # Avoid using quotes unless it's necessary.
+        targets[target][0] = targets[target][0].replace(
+            "x86_64-unknown-linux-gnu",
+            "'{}'".format(target) if "." in target else target,
+        )
+
+    if "profile" not in config:
+        set("profile", "dist", config)
+    configure_file(sections, top_level_keys, targets, config, indexes)
+    return section_order, sections, targets
+
+
+def load_example_config(cache_path=None):
+    """Split bootstrap.example.toml into the sections of the config
+
+    Returns `(section_order, sections, top_level_keys, indexes)`, which the
+    caller must not modify. It's only parsed once per process, and if
+    `cache_path` is given, the result is kept in that file and reused for as
+    long as the content of the example config doesn't change.
+    """
+    with open(rust_dir + "/bootstrap.example.toml") as example_config:
+        content = example_config.read()
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    if digest in parsed_example_configs:
+        return parsed_example_configs[digest]
+
+    parsed = None
+    if cache_path is not None:
+        try:
+            with open(cache_path, "rb") as f:
+                cached_digest, cached = marshal.loads(f.read())
+            if cached_digest == digest:
+                parsed = cached
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    if parsed is None:
+        parsed = parse_example_lines(content.split("\n"))
+        if cache_path is not None:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                with open(cache_path + ".tmp", "wb") as f:
+                    f.write(marshal.dumps((digest, parsed)))
+                os.replace(cache_path + ".tmp", cache_path)
+            except OSError:
+                pass
+    parsed_example_configs[digest] = parsed
+    return parsed
+
+
+def parse_example_lines(example_lines):
     sections = {}
     cur_section = None
     sections[None] = []
     section_order = [None]
-    targets = {}
     top_level_keys = []
     comment_lines = []
+    # The line of each key in each section, found along the way. The copies of
+    # the `target` section have their keys on the same lines as the section.
+    indexes = {None: {}}
 
-    with open(rust_dir + "/bootstrap.example.toml") as example_config:
-        example_lines = example_config.read().split("\n")
     for line in example_lines:
         if line.count("=") >= 1 and not line.startswith("# "):
             key = line.split("=")[0]
@@ -599,6 +691,7 @@ def parse_example_config(known_args, config):
                 cur_section = parts[0]
                 if cur_section not in sections:
                     sections[cur_section] = ["[" + cur_section + "]"]
+                    indexes[cur_section] = {}
                     section_order.append(cur_section)
             elif cur_section is None:
                 top_level_keys.append(key)
@@ -607,9 +700,11 @@ def parse_example_config(known_args, config):
             sections[cur_section] += comment_lines
             comment_lines = []
             # remove just the `section.` part from the line, if present.
-            sections[cur_section].append(
-                re.sub("(#?)([a-zA-Z_-]+\\.)?(.*)", "\\1\\3", line)
-            )
+            line = re.sub("(#?)([a-zA-Z_-]+\\.)?(.*)", "\\1\\3", line)
+            key = config_line_key(line, commented_only=cur_section is not None)
+            if key is not None:
+                indexes[cur_section].setdefault(key, len(sections[cur_section]))
+            sections[cur_section].append(line)
         elif line.startswith("["):
             cur_section = line[1:-1]
             if cur_section.startswith("target"):
@@ -619,35 +714,69 @@ def parse_example_config(known_args, config):
                     "don't know how to deal with section: {}".format(cur_section)
                 )
             sections[cur_section] = [line]
+            indexes[cur_section] = {}
             section_order.append(cur_section)
         else:
             comment_lines.append(line)
 
     sections[cur_section] += comment_lines
-    # Fill out the `targets` array by giving all configured targets a copy of the
-    # `target` section we just loaded from the example config
-    configured_targets = [build(known_args)]
-    if "build" in config:
-        if "host" in config["build"]:
-            configured_targets += config["build"]["host"]
-        if "target" in config["build"]:
-            configured_targets += config["build"]["target"]
-    if "target" in config:
-        for target in config["target"]:
-            configured_targets.append(target)
-    for target in configured_targets:
-        targets[target] = sections["target"][:]
-        # For `.` to be valid TOML, it needs to be quoted. But `bootstrap.py` doesn't use a proper TOML parser and fails to parse the target.
-        # Avoid using quotes unless it's necessary.
-        targets[target][0] = targets[target][0].replace(
-            "x86_64-unknown-linux-gnu",
-            "'{}'".format(target) if "." in target else target,
-        )
+    return section_order, sections, top_level_keys, indexes
 
-    if "profile" not in config:
-        set("profile", "dist", config)
-    configure_file(sections, top_level_keys, targets, config)
-    return section_order, sections, targets
+
+class TargetSection(object):
+    """The lines of the `target` section of the config for one target
+
+    Rather than a copy of the section in the example config, this keeps the
+    lines that were changed for the target, and applies them while the
+    section is iterated over.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.changed = {}
+
+    def __len__(self):
+        return len(self.template)
+
+    def __getitem__(self, i):
+        return self.changed.get(i, self.template[i])
+
+    def __setitem__(self, i, line):
+        self.changed[i] = line
+
+    def __iter__(self):
+        for i, line in enumerate(self.template):
+            yield self.changed.get(i, line)
+
+
+def config_line_key(line, commented_only=True):
+    """Return the key that a line of the example config sets, if any
+
+    Only lines that are commented out count, unless `commented_only` is false.
+
+    >>> config_line_key("#cargo = 'cargo'")
+    'cargo'
+    >>> config_line_key("change-id = 1") is None
+    True
+    >>> config_line_key("change-id = 1", commented_only=False)
+    'change-id'
+    """
+    if line.startswith("#"):
+        line = line[1:]
+    elif commented_only:
+        return None
+    key, eq, _ = line.partition(" = ")
+    return key if eq else None
+
+
+def index_config_lines(lines, commented_only=True):
+    """Map each key in `lines` to the first line that sets it"""
+    index = {}
+    for i, line in enumerate(lines):
+        key = config_line_key(line, commented_only)
+        if key is not None:
+            index.setdefault(key, i)
+    return index
 
 
 def is_number(value):
@@ -691,17 +820,15 @@ def to_toml(value):
         raise RuntimeError("no toml")
 
 
-def configure_section(lines, config):
+def configure_section(lines, config, index=None):
+    if index is None:
+        index = index_config_lines(lines)
     for key in config:
         value = config[key]
-        found = False
-        for i, line in enumerate(lines):
-            if not line.startswith("#" + key + " = "):
-                continue
-            found = True
+        i = index.get(key)
+        if i is not None:
             lines[i] = "{} = {}".format(key, to_toml(value))
-            break
-        if not found:
+        else:
             # These are used by rpm, but aren't accepted by x.py.
             # Give a warning that they're ignored, but not a hard error.
             if key in ["infodir", "localstatedir"]:
@@ -710,68 +837,89 @@ def configure_section(lines, config):
                 raise RuntimeError("failed to find config line for {}".format(key))
 
 
-def configure_top_level_key(lines, top_level_key, value):
-    for i, line in enumerate(lines):
-        if line.startswith("#" + top_level_key + " = ") or line.startswith(
-            top_level_key + " = "
-        ):
-            lines[i] = "{} = {}".format(top_level_key, to_toml(value))
-            return
-
-    raise RuntimeError("failed to find config line for {}".format(top_level_key))
+def configure_top_level_key(lines, top_level_key, value, index=None):
+    if index is None:
+        index = index_config_lines(lines, commented_only=False)
+    i = index.get(top_level_key)
+    if i is None:
+        raise RuntimeError("failed to find config line for {}".format(top_level_key))
+    lines[i] = "{} = {}".format(top_level_key, to_toml(value))
 
 
 # Modify `sections` to reflect the parsed arguments and example configs.
-def configure_file(sections, top_level_keys, targets, config):
+# `indexes` has the `index_config_lines` of each section, if it's known.
+def configure_file(sections, top_level_keys, targets, config, indexes=None):
+    if indexes is None:
+        indexes = {}
     for section_key, section_config in config.items():
         if section_key not in sections and section_key not in top_level_keys:
             raise RuntimeError(
                 "config key {} not in sections or top_level_keys".format(section_key)
             )
         if section_key in top_level_keys:
-            configure_top_level_key(sections[None], section_key, section_config)
+            configure_top_level_key(
+                sections[None], section_key, section_config, indexes.get(None)
+            )
 
         elif section_key == "target":
             for target in section_config:
-                configure_section(targets[target], section_config[target])
+                configure_section(
+                    targets[target], section_config[target], indexes.get("target")
+                )
         else:
-            configure_section(sections[section_key], section_config)
+            configure_section(
+                sections[section_key], section_config, indexes.get(section_key)
+            )
 
 
-def write_uncommented(target, f):
-    """Writes each block in 'target' that is not composed entirely of comments to 'f'.
+def uncommented_lines(target):
+    """Yields the lines of each block in 'target' that is not composed entirely of comments.
+
+    A block is a sequence of non-empty lines separated by empty lines. Only
+    the current block is held in memory.
 
-    A block is a sequence of non-empty lines separated by empty lines.
+    >>> list(uncommented_lines(["[build]", "#a = 1", "", "#b = 2", "", "c = 3"]))
+    ['[build]', '#a = 1', '', 'c = 3', '']
     """
     block = []
-
-    def flush(last):
-        # If the block is entirely made of comments, ignore it
-        entire_block_comments = all(ln.startswith("#") or ln == "" for ln in block)
-        if not entire_block_comments and len(block) > 0:
-            for line in block:
-                f.write(line + "\n")
-            # Required to output a newline before the start of a new section
-            if last:
-                f.write("\n")
-        block.clear()
-
+    commented = True
     for line in target:
         block.append(line)
+        if commented and not (line.startswith("#") or line == ""):
+            commented = False
         if len(line) == 0:
-            flush(last=False)
+            # If the block is entirely made of comments, ignore it
+            if not commented:
+                yield from block
+            block = []
+            commented = True
+
+    if not commented:
+        yield from block
+        # Required to output a newline before the start of a new section
+        yield ""
+
 
-    flush(last=True)
+def write_uncommented(target, f):
+    """Writes each block in 'target' that is not composed entirely of comments to 'f'."""
+    for line in uncommented_lines(target):
+        f.write(line + "\n")
     return f
 
 
-def write_config_toml(writer, section_order, targets, sections):
+def config_toml_lines(section_order, targets, sections):
+    """Yields the lines of the `bootstrap.toml` to write, one section at a time"""
     for section in section_order:
         if section == "target":
             for target in targets:
-                writer = write_uncommented(targets[target], writer)
+                yield from uncommented_lines(targets[target])
         else:
-            writer = write_uncommented(sections[section], writer)
+            yield from uncommented_lines(sections[section])
+
+
+def write_config_toml(writer, section_order, targets, sections):
+    for line in config_toml_lines(section_order, targets, sections):
+        writer.write(line + "\n")
 
 
 def quit_if_file_exists(file):
@@ -786,9 +934,135 @@ def quit_if_file_exists(file):
         err(msg)
 
 
+def write_files(directory, section_order, targets, sections):
+    """Write `bootstrap.toml` and the `Makefile` into `directory`"""
+    with bootstrap.output(os.path.join(directory, "bootstrap.toml")) as f:
+        write_config_toml(f, section_order, targets, sections)
+
+    with bootstrap.output(os.path.join(directory, "Makefile")) as f:
+        contents = os.path.join(rust_dir, "src", "bootstrap", "mk", "Makefile.in")
+        contents = open(contents).read()
+        contents = contents.replace("$(CFG_SRC_DIR)", rust_dir + "/")
+        contents = contents.replace("$(CFG_PYTHON)", sys.executable)
+        f.write(contents)
+
+
+def read_batch_file(path):
+    """Read the jobs of `./configure --batch <path>`
+
+    Each job names a directory and the arguments to configure it with:
+
+    * in a `.json` file, as a list of `{"directory": ..., "args": [...]}`,
+    * in a `.csv` file, as a row of the directory followed by one argument per
+      cell,
+    * otherwise, as a line of the directory followed by the arguments, quoted
+      like in a shell.
+
+    Empty lines and lines or rows starting with `#` are ignored. Returns a
+    list of `(directory, args)`.
+    """
+    jobs = []
+    with open(path, newline="" if path.endswith(".csv") else None) as f:
+        if path.endswith(".json"):
+            for job in json.load(f):
+                jobs.append((job["directory"], list(job.get("args", []))))
+        elif path.endswith(".csv"):
+            for row in csv.reader(f):
+                if row and row[0] and not row[0].startswith("#"):
+                    jobs.append((row[0], [arg for arg in row[1:] if arg]))
+        else:
+            for line in f:
+                words = shlex.split(line, comments=True)
+                if words:
+                    jobs.append((words[0], words[1:]))
+    return jobs
+
+
+def configure_job(job):
+    """Configure `directory` as `./configure <args>` would in it
+
+    Returns the directory if that failed, and None otherwise.
+    """
+    directory, args = job
+    p("configuring {}".format(directory))
+    try:
+        quit_if_file_exists(os.path.join(directory, "bootstrap.toml"))
+        section_order, sections, targets = parse_args(args)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        write_files(directory, section_order, targets, sections)
+    except SystemExit:
+        # `err` already explained why.
+        return directory
+    except (RuntimeError, OSError) as e:
+        print("\nconfigure: ERROR: {}\n".format(e))
+        return directory
+    return None
+
+
+def buffered_configure_job(job):
+    """Run `configure_job`, returning its result and what it printed"""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        failed = configure_job(job)
+    return failed, output.getvalue()
+
+
+def configure_batch(jobs, processes=1):
+    """Configure each `(directory, args)` of `jobs`, see `configure_job`
+
+    With several `processes`, the jobs are spread across a process pool. Each
+    process parses bootstrap.example.toml and detects the build triple once
+    for all of its jobs, and the output of each job is printed in one piece
+    once it's done. Returns the directories that couldn't be configured.
+    """
+    # `set` is taken by the function above.
+    directories = {os.path.abspath(directory) for directory, _ in jobs}
+    if len(directories) != len(jobs):
+        err("the same directory is configured more than once")
+
+    if processes > 1 and len(jobs) > 1:
+        from multiprocessing import Pool
+
+        results = []
+        with Pool(min(processes, len(jobs))) as pool:
+            for failed, output in pool.imap(buffered_configure_job, jobs):
+                sys.stdout.write(output)
+                sys.stdout.flush()
+                results.append(failed)
+    else:
+        results = [configure_job(job) for job in jobs]
+    return [directory for directory in results if directory is not None]
+
+
+def batch_main(args):
+    """Entry point of `./configure --batch <file> [-j N]`"""
+    parser = argparse.ArgumentParser(prog="configure --batch")
+    parser.add_argument("file", help="a .json, .csv or text file listing the jobs")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=bootstrap.get_cpus(),
+        help="how many directories to configure in parallel",
+    )
+    args = parser.parse_args(args)
+
+    failed = configure_batch(read_batch_file(args.file), args.jobs)
+    if failed:
+        err("failed to configure {}".format(", ".join(failed)))
+    return 0
+
+
 if __name__ == "__main__":
+    # `./configure --batch <file>` configures many directories at once, parsing
+    # bootstrap.example.toml only once per process.
+    if sys.argv[1:2] == ["--batch"]:
+        sys.exit(batch_main(sys.argv[2:]))
+
     # If 'bootstrap.toml' already exists, exit the script at this point
     quit_if_file_exists("bootstrap.toml")
+    USE_TEMPLATE_CACHE = True
 
     if "GITHUB_ACTIONS" in os.environ:
         print("::group::Configure the build")
@@ -802,15 +1076,7 @@ if __name__ == "__main__":
     # order that we read it in.
     p("")
     p("writing `bootstrap.toml` in current directory")
-    with bootstrap.output("bootstrap.toml") as f:
-        write_config_toml(f, section_order, targets, sections)
-
-    with bootstrap.output("Makefile") as f:
-        contents = os.path.join(rust_dir, "src", "bootstrap", "mk", "Makefile.in")
-        contents = open(contents).read()
-        contents = contents.replace("$(CFG_SRC_DIR)", rust_dir + "/")
-        contents = contents.replace("$(CFG_PYTHON)", sys.executable)
-        f.write(contents)
+    write_files("", section_order, targets, sections)
 
     p("")
     p("run `{} {}/x.py --help`".format(os.path.basename(sys.executable), rust_dir))